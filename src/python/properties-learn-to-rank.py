@@ -13,18 +13,35 @@ CLI Usage:
     python properties-learn-to-rank.py train-model    # Train the model only
     python properties-learn-to-rank.py deploy-model   # Deploy an existing model only
     python properties-learn-to-rank.py train-and-deploy-model   # Train and deploy the model
+    python properties-learn-to-rank.py train-model --slices 4   # Export events with 4 parallel PIT slices
+    python properties-learn-to-rank.py train-model --full-refresh   # Ignore the incremental watermark and re-extract
+    python properties-learn-to-rank.py train-model --offline   # Train from local event/property files, no cluster
+    python properties-learn-to-rank.py train-model --offline --properties-id-field doc_id   # Key properties by the id field events use
+    python properties-learn-to-rank.py build-embeddings   # Precompute property embeddings for local semantic features
+    python properties-learn-to-rank.py build-embeddings --offline   # Embed LTR_OFFLINE_PROPERTIES instead of the properties index
+    python properties-learn-to-rank.py benchmark-embeddings   # Compare fp32 and int8 encoders (throughput, cosine agreement)
 """
 import os
 import sys
 import json
 import re
+import itertools
+import queue
+import threading
+import time
 import warnings
 import pickle
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import hashlib
+import sqlite3
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import typer
-from datetime import datetime, timedelta
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Any, Tuple, Optional
 from pathlib import Path
 
@@ -40,7 +57,8 @@ try:
     from sklearn.preprocessing import StandardScaler
     from sklearn.model_selection import train_test_split
     from sklearn.metrics import ndcg_score
-    from elasticsearch import Elasticsearch
+    from scipy import sparse
+    from elasticsearch import Elasticsearch, helpers
     import xgboost
     from eland.ml import MLModel
     from eland.ml.ltr import LTRModelConfig, QueryFeatureExtractor
@@ -50,10 +68,1343 @@ except ImportError as e:
     print(f"   Error: {e}")
     sys.exit(1)
 
+# Optional: Parquet event spool
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Optional: local embedding encoder for semantic features
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+# Field projection: only the fields each stage actually reads are requested from Elasticsearch
+EVENT_SOURCE_FIELDS = {
+    'search_result_logged': [
+        '@timestamp',
+        'custom.session.id',
+        'custom.result.position',
+        'custom.result.document_id',
+        'custom.query',
+        'custom.performance.search_time_ms'
+    ],
+    'property_engagement': [
+        '@timestamp',
+        'custom.session.id',
+        'custom.result.position',
+        'custom.result.document_id',
+        'custom.interaction.type'
+    ]
+}
+
+# Property attributes read by extract_property_attributes / calculate_query_document_matching / calculate_geo_relevance
+# (excludes the *_semantic inference payloads)
+PROPERTY_SOURCE_FIELDS = [
+    'title',
+    'property-description',
+    'property-features',
+    'property-status',
+    'home-price',
+    'number-of-bedrooms',
+    'number-of-bathrooms',
+    'square-footage',
+    'annual-tax',
+    'maintenance-fee',
+    'state',
+    'location',
+    'geo_point'
+]
+
+# BM25 fields as (field, boost, feature name); boosts match the multi_match used by get_bm25_scores
+BM25_FIELDS = [
+    ('title', 2.0, 'bm25_title_score'),
+    ('property-description', 1.5, 'bm25_description_score'),
+    ('property-features', 1.2, 'bm25_features_score'),
+    ('headings', 1.1, 'bm25_headings_score')
+]
+
+# filter_path per call type: strips _shards, took, timed_out, hits.total, _index, ...
+EVENTS_PAGE_FILTER_PATH = 'pit_id,hits.hits._id,hits.hits._source,hits.hits.sort'
+PROPERTY_GET_FILTER_PATH = '_id,_source,found'
+EXPLAIN_FILTER_PATH = 'matched,explanation.value,explanation.details.description,explanation.details.value'
+SCORE_FILTER_PATH = 'hits.hits._id,hits.hits._score'
+NAMED_SCORES_FILTER_PATH = 'hits.hits._id,hits.hits.matched_queries'
+# status keeps one entry per sub-search so responses stay aligned with the request order
+MSEARCH_SCORES_FILTER_PATH = ('responses.status,responses.error.reason,responses.hits.hits._id,'
+                              'responses.hits.hits._score,responses.hits.hits.matched_queries')
+SEMANTIC_FIELDS = ('property-description_semantic', 'property-features_semantic')
+
+# Enrichment feature families and their versions; bump a version when its computation
+# changes so the feature store recomputes that family only
+FEATURE_FAMILY_VERSIONS = {
+    'bm25': 1,
+    'semantic': 2,
+    'attributes': 1,
+    'geo': 1,
+    'matching': 1
+}
+CLUSTER_FEATURE_FAMILIES = ('bm25', 'semantic')
+
+# Column order of extract_property_attributes_batch
+ATTRIBUTE_FEATURES = [
+    'property_price_normalized',
+    'bedrooms_match_score',
+    'bathrooms_match_score',
+    'square_footage_normalized',
+    'annual_tax_normalized',
+    'maintenance_fee_normalized',
+    'price_value_competitiveness',
+    'absolute_price_tier'
+]
+
+
+class EventSpool:
+    """Day-partitioned Parquet spool of flattened events under LTR_MODEL_DIR
+
+    Layout: <root>/action=<action>/date=<YYYY-MM-DD>/part-*.parquet, with a _SUCCESS
+    marker once a past day has been fetched completely.
+    """
+
+    # Flattened column -> (path into the event source, Arrow type)
+    COLUMNS = {
+        'search_result_logged': {
+            'event_id': (None, 'string'),
+            'timestamp': (('@timestamp',), 'string'),
+            'session_id': (('custom', 'session', 'id'), 'string'),
+            'position': (('custom', 'result', 'position'), 'int64'),
+            'document_id': (('custom', 'result', 'document_id'), 'string'),
+            'query_text': (('custom', 'query', 'text'), 'string'),
+            'template_id': (('custom', 'query', 'template_id'), 'string'),
+            'result_count': (('custom', 'query', 'result_count'), 'int64'),
+            'filters': (('custom', 'query', 'filters'), 'json'),
+            'search_time_ms': (('custom', 'performance', 'search_time_ms'), 'float64')
+        },
+        'property_engagement': {
+            'event_id': (None, 'string'),
+            'timestamp': (('@timestamp',), 'string'),
+            'session_id': (('custom', 'session', 'id'), 'string'),
+            'position': (('custom', 'result', 'position'), 'int64'),
+            'document_id': (('custom', 'result', 'document_id'), 'string'),
+            'interaction_type': (('custom', 'interaction', 'type'), 'string')
+        }
+    }
+
+    def __init__(self, root: str, rows_per_file: int = 100000):
+        self.root = root
+        self.rows_per_file = rows_per_file
+        self._buffers = {}
+        self._run_id = datetime.now().strftime('%Y%m%dT%H%M%S')
+        self._part_seq = 0
+
+    def partition_dir(self, action_type: str, day: str) -> str:
+        return os.path.join(self.root, f"action={action_type}", f"date={day}")
+
+    def is_complete(self, action_type: str, day: str) -> bool:
+        return os.path.exists(os.path.join(self.partition_dir(action_type, day), '_SUCCESS'))
+
+    def clear_partition(self, action_type: str, day: str):
+        """Drop a partition before it is re-fetched in full"""
+        path = self.partition_dir(action_type, day)
+        if os.path.isdir(path):
+            for name in os.listdir(path):
+                os.remove(os.path.join(path, name))
+
+    def mark_complete(self, action_type: str, day: str):
+        path = self.partition_dir(action_type, day)
+        os.makedirs(path, exist_ok=True)
+        Path(os.path.join(path, '_SUCCESS')).touch()
+
+    def _schema(self, action_type: str):
+        return pa.schema([
+            (name, pa.string() if kind in ('string', 'json') else getattr(pa, kind)())
+            for name, (_, kind) in self.COLUMNS[action_type].items()
+        ])
+
+    def flatten(self, action_type: str, hit: dict) -> dict:
+        """Flatten an event hit into a spool row"""
+        source = hit.get('_source', {})
+        row = {}
+        for name, (path, kind) in self.COLUMNS[action_type].items():
+            if path is None:
+                row[name] = hit.get('_id')
+                continue
+            value = source
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+            if kind == 'json':
+                value = json.dumps(value) if value is not None else None
+            elif kind == 'int64' and value is not None:
+                value = int(value)
+            elif kind == 'float64' and value is not None:
+                value = float(value)
+            row[name] = value
+        return row
+
+    def unflatten(self, action_type: str, row: dict) -> dict:
+        """Rebuild an event hit (nested custom.* source) from a spool row"""
+        source = {}
+        for name, (path, kind) in self.COLUMNS[action_type].items():
+            value = row.get(name)
+            if path is None or value is None:
+                continue
+            if kind == 'json':
+                value = json.loads(value)
+            node = source
+            for key in path[:-1]:
+                node = node.setdefault(key, {})
+            node[path[-1]] = value
+        return {'_id': row.get('event_id'), '_source': source}
+
+    def append(self, action_type: str, day: str, row: dict):
+        buffer = self._buffers.setdefault((action_type, day), [])
+        buffer.append(row)
+        if len(buffer) >= self.rows_per_file:
+            self.flush(action_type, day)
+
+    def flush(self, action_type: str, day: Optional[str] = None):
+        """Write buffered rows for one (or every) day of an action type as new part files"""
+        for key in [k for k in self._buffers if k[0] == action_type and (day is None or k[1] == day)]:
+            rows = self._buffers.pop(key)
+            if not rows:
+                continue
+            path = self.partition_dir(*key)
+            os.makedirs(path, exist_ok=True)
+            self._part_seq += 1
+            table = pa.Table.from_pylist(rows, schema=self._schema(action_type))
+            pq.write_table(table, os.path.join(path, f"part-{self._run_id}-{self._part_seq:05d}.parquet"))
+
+    def read(self, action_type: str, day: str, columns: Optional[List[str]] = None):
+        """Yield spool rows for a partition, reading only the requested columns"""
+        path = self.partition_dir(action_type, day)
+        if not os.path.isdir(path):
+            return
+        columns = columns or list(self.COLUMNS[action_type])
+        for name in sorted(os.listdir(path)):
+            if not name.endswith('.parquet'):
+                continue
+            parquet_file = pq.ParquetFile(os.path.join(path, name))
+            for batch in parquet_file.iter_batches(columns=columns):
+                yield from batch.to_pylist()
+
+
+class FeatureStore:
+    """SQLite store of enrichment features under LTR_MODEL_DIR
+
+    Rows are keyed by (normalized query hash, doc id, feature family) and carry the
+    family version and a hash of the projected document _source they were computed
+    from; rows from another version or an edited document read as misses. Writes are
+    buffered and flushed in batches.
+    """
+
+    def __init__(self, path: str, versions: Dict[str, Any], flush_rows: int = 5000):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.versions = versions
+        self.flush_rows = flush_rows
+        self._pending = []
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS features ('
+            ' query_hash TEXT NOT NULL, doc_id TEXT NOT NULL, family TEXT NOT NULL,'
+            ' version TEXT NOT NULL, features TEXT NOT NULL, content_hash TEXT NOT NULL DEFAULT \'\','
+            ' PRIMARY KEY (query_hash, doc_id, family))'
+        )
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(features)')}
+        if 'content_hash' not in columns:
+            # Stores written before content hashing read as misses and are refreshed on write
+            self.conn.execute("ALTER TABLE features ADD COLUMN content_hash TEXT NOT NULL DEFAULT ''")
+        self.conn.commit()
+
+    @staticmethod
+    def query_hash(query: str) -> str:
+        return hashlib.sha1(query.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def content_hash(source: dict) -> str:
+        """Hash of the feature-relevant projection of a property _source"""
+        projected = {field: source[field] for field in PROPERTY_SOURCE_FIELDS if field in source}
+        return hashlib.sha1(json.dumps(projected, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def get_many(self, query: str, content_hashes: Dict[str, str]) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """Families stored for a query's documents at the current version and document content
+
+        `content_hashes` maps doc_id -> content_hash of its current _source; returns doc_id -> family -> features.
+        """
+        query_hash = self.query_hash(query)
+        stored = {}
+        doc_ids = list(content_hashes)
+        for i in range(0, len(doc_ids), 500):  # stay below SQLite's bound-parameter limit
+            chunk = doc_ids[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT doc_id, family, version, content_hash, features FROM features "
+                f"WHERE query_hash = ? AND doc_id IN ({','.join('?' * len(chunk))})",
+                [query_hash, *chunk]
+            )
+            for doc_id, family, version, content_hash, features in rows:
+                if str(self.versions.get(family)) == str(version) and content_hashes[doc_id] == content_hash:
+                    stored.setdefault(doc_id, {})[family] = json.loads(features)
+        return stored
+
+    def put(self, query: str, doc_id: str, family: str, features: Dict[str, float], content_hash: str):
+        self._pending.append((self.query_hash(query), doc_id, family, str(self.versions[family]),
+                              json.dumps(features), content_hash))
+        if len(self._pending) >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO features (query_hash, doc_id, family, version, features, content_hash) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            self._pending
+        )
+        self.conn.commit()
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+class PropertyCache:
+    """Byte-bounded LRU cache of property _source documents
+
+    Entry sizes are estimated from the Python objects (sys.getsizeof over the nested
+    dicts, lists and strings). Least recently used entries are evicted once the
+    budget is exceeded, or moved to a SQLite spill file when one is configured and
+    promoted back on access.
+    """
+
+    def __init__(self, max_bytes: int, spill_path: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.resident_bytes = 0
+        self._entries = OrderedDict()  # doc_id -> (source, size)
+        self._lock = threading.RLock()
+        self.stats = {'hits': 0, 'spill_hits': 0, 'misses': 0, 'evictions': 0, 'spilled': 0}
+        self._spill = None
+        if spill_path:
+            os.makedirs(os.path.dirname(spill_path), exist_ok=True)
+            self._spill = sqlite3.connect(spill_path, check_same_thread=False)
+            self._spill.execute('CREATE TABLE IF NOT EXISTS properties (doc_id TEXT PRIMARY KEY, source TEXT NOT NULL)')
+            # Spilled documents are only valid for this run
+            self._spill.execute('DELETE FROM properties')
+            self._spill.commit()
+
+    @classmethod
+    def approx_size(cls, value) -> int:
+        size = sys.getsizeof(value)
+        if isinstance(value, dict):
+            size += sum(cls.approx_size(k) + cls.approx_size(v) for k, v in value.items())
+        elif isinstance(value, (list, tuple)):
+            size += sum(cls.approx_size(v) for v in value)
+        return size
+
+    def _spilled(self, doc_id: str) -> Optional[dict]:
+        if self._spill is None:
+            return None
+        row = self._spill.execute('SELECT source FROM properties WHERE doc_id = ?', (doc_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def __contains__(self, doc_id: str) -> bool:
+        with self._lock:
+            if doc_id in self._entries:
+                return True
+        return self._spill is not None and self._spill.execute(
+            'SELECT 1 FROM properties WHERE doc_id = ?', (doc_id,)
+        ).fetchone() is not None
+
+    def get(self, doc_id: str, default=None):
+        with self._lock:
+            entry = self._entries.get(doc_id)
+            if entry is not None:
+                self._entries.move_to_end(doc_id)
+                self.stats['hits'] += 1
+                return entry[0]
+            source = self._spilled(doc_id)
+            if source is None:
+                self.stats['misses'] += 1
+                return default
+            self.stats['spill_hits'] += 1
+            self[doc_id] = source
+            return source
+
+    def __getitem__(self, doc_id: str) -> dict:
+        source = self.get(doc_id)
+        if source is None:
+            raise KeyError(doc_id)
+        return source
+
+    def __setitem__(self, doc_id: str, source: dict):
+        size = self.approx_size(doc_id) + self.approx_size(source)
+        with self._lock:
+            previous = self._entries.pop(doc_id, None)
+            if previous is not None:
+                self.resident_bytes -= previous[1]
+            self._entries[doc_id] = (source, size)
+            self.resident_bytes += size
+            evicted = []
+            while self.resident_bytes > self.max_bytes and len(self._entries) > 1:
+                old_id, (old_source, old_size) = self._entries.popitem(last=False)
+                self.resident_bytes -= old_size
+                self.stats['evictions'] += 1
+                evicted.append((old_id, json.dumps(old_source)))
+            if evicted and self._spill is not None:
+                self._spill.executemany('INSERT OR REPLACE INTO properties VALUES (?, ?)', evicted)
+                self._spill.commit()
+                self.stats['spilled'] += len(evicted)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def hit_rate(self) -> float:
+        lookups = self.stats['hits'] + self.stats['spill_hits'] + self.stats['misses']
+        return (self.stats['hits'] + self.stats['spill_hits']) / lookups if lookups else 0.0
+
+    def close(self):
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+
+class PropertyAttributeStore:
+    """Columnar numeric property attributes with an interned doc id -> row index
+
+    One float64 array per attribute (NaN where the document lacks it) plus flags for
+    the Florida pricing rule and for documents whose attributes are present but not
+    numeric; those "irregular" rows keep going through the per-document dict path.
+    """
+
+    COLUMNS = ('home-price', 'number-of-bedrooms', 'number-of-bathrooms', 'square-footage',
+               'annual-tax', 'maintenance-fee')
+    SOURCE_FIELDS = list(COLUMNS) + ['state']
+
+    def __init__(self, capacity: int = 1024):
+        self.doc_index = {}
+        self.size = 0
+        self.columns = {name: np.full(capacity, np.nan) for name in self.COLUMNS}
+        self.is_fl = np.zeros(capacity, dtype=bool)
+        self.irregular = np.zeros(capacity, dtype=bool)
+
+    @classmethod
+    def from_documents(cls, documents) -> 'PropertyAttributeStore':
+        documents = list(documents)
+        store = cls(capacity=max(len(documents), 1))
+        for doc_id, source in documents:
+            store.add(doc_id, source)
+        return store
+
+    def _grow(self):
+        capacity = len(self.is_fl) * 2
+        for name, values in self.columns.items():
+            self.columns[name] = np.concatenate([values, np.full(capacity - len(values), np.nan)])
+        self.is_fl = np.concatenate([self.is_fl, np.zeros(capacity - len(self.is_fl), dtype=bool)])
+        self.irregular = np.concatenate([self.irregular, np.zeros(capacity - len(self.irregular), dtype=bool)])
+
+    def add(self, doc_id: str, source: dict) -> int:
+        row = self.doc_index.get(doc_id)
+        if row is None:
+            if self.size == len(self.is_fl):
+                self._grow()
+            row = self.size
+            self.doc_index[sys.intern(doc_id)] = row
+            self.size += 1
+        irregular = False
+        for name in self.COLUMNS:
+            value = source.get(name)
+            if (value is None and name in source) or not isinstance(value, (int, float, type(None))):
+                irregular = True
+                value = None
+            self.columns[name][row] = np.nan if value is None else value
+        self.is_fl[row] = source.get('state') == 'FL'
+        self.irregular[row] = irregular
+        return row
+
+    def rows(self, doc_ids: List[str]) -> np.ndarray:
+        """Row per doc id, -1 for documents not in the store"""
+        return np.array([self.doc_index.get(doc_id, -1) for doc_id in doc_ids], dtype=np.int64)
+
+    def gather(self, rows: np.ndarray) -> Dict[str, np.ndarray]:
+        """Attribute arrays for the given rows"""
+        return {name: values[rows] for name, values in self.columns.items()}
+
+    def nbytes(self) -> int:
+        return sum(values[:self.size].nbytes for values in self.columns.values()) + 2 * self.size
+
+
+class PropertyGeoIndex:
+    """Property coordinates as NumPy arrays plus a geohash-prefix bucket index
+
+    Every document gets an integer geohash of `precision` characters; sorting those
+    codes makes each geohash cell a contiguous range, so the documents sharing a
+    cell with any point are found with two binary searches.
+    """
+
+    EARTH_RADIUS_KM = 6371.0088
+    # Elasticsearch distance units in km, matched case-insensitively; a bare number is in meters
+    DISTANCE_UNITS = {'km': 1.0, 'kilometers': 1.0, 'm': 0.001, 'meters': 0.001, 'mi': 1.609344, 'miles': 1.609344,
+                      'yd': 0.0009144, 'yards': 0.0009144, 'ft': 0.0003048, 'feet': 0.0003048,
+                      'nmi': 1.852, 'nm': 1.852, 'in': 0.0000254, 'cm': 0.00001, 'mm': 0.000001}
+    DISTANCE_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([A-Za-z]*)\s*$')
+    _unparsable_distances = set()  # distances already reported, so each is logged once
+
+    def __init__(self, precision: int = 6, capacity: int = 1024):
+        self.precision = precision
+        self.doc_index = {}
+        self.size = 0
+        self.lat = np.full(capacity, np.nan)
+        self.lon = np.full(capacity, np.nan)
+        self._sorted_codes = None
+        self._rank = None
+
+    @classmethod
+    def from_documents(cls, documents, precision: int = 6) -> 'PropertyGeoIndex':
+        documents = list(documents)
+        index = cls(precision=precision, capacity=max(len(documents), 1))
+        for doc_id, source in documents:
+            index.add(doc_id, source)
+        return index
+
+    @staticmethod
+    def coordinates(value) -> Optional[Tuple[float, float]]:
+        """(lat, lon) of a geo_point given as {lat, lon}, "lat,lon" or [lon, lat]"""
+        try:
+            if isinstance(value, dict):
+                return float(value['lat']), float(value['lon'])
+            if isinstance(value, str) and ',' in value:
+                lat, lon = value.split(',', 1)
+                return float(lat), float(lon)
+            if isinstance(value, (list, tuple)) and len(value) == 2:
+                return float(value[1]), float(value[0])
+        except (KeyError, TypeError, ValueError):
+            pass
+        return None
+
+    @classmethod
+    def parse_distance_km(cls, value, default: float = 10.0) -> float:
+        """Geo filter distance ("5km", "2 Mi", 1500) in km, `default` when absent or unparsable"""
+        if value is None:
+            return default
+        match = cls.DISTANCE_PATTERN.match(str(value))
+        unit = (match.group(2).lower() or 'm') if match else None
+        if unit in cls.DISTANCE_UNITS and float(match.group(1)) > 0:
+            return float(match.group(1)) * cls.DISTANCE_UNITS[unit]
+        if str(value) not in cls._unparsable_distances:
+            cls._unparsable_distances.add(str(value))
+            print(f"⚠️  Unparsable geo filter distance {value!r}; using {default} km")
+        return default
+
+    def add(self, doc_id: str, source: dict) -> int:
+        row = self.doc_index.get(doc_id)
+        if row is None:
+            if self.size == len(self.lat):
+                self.lat = np.concatenate([self.lat, np.full(len(self.lat), np.nan)])
+                self.lon = np.concatenate([self.lon, np.full(len(self.lon), np.nan)])
+            row = self.size
+            self.doc_index[sys.intern(doc_id)] = row
+            self.size += 1
+        coordinates = self.coordinates(source.get('geo_point'))
+        self.lat[row], self.lon[row] = coordinates if coordinates is not None else (np.nan, np.nan)
+        self._sorted_codes = None
+        return row
+
+    def rows(self, doc_ids: List[str]) -> np.ndarray:
+        """Row per doc id, -1 for documents not in the index"""
+        return np.array([self.doc_index.get(doc_id, -1) for doc_id in doc_ids], dtype=np.int64)
+
+    def geohash(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        """Integer geohashes (5 bits per character, longitude bit first); -1 where coordinates are missing"""
+        bits = 5 * self.precision
+        lon_bits, lat_bits = (bits + 1) // 2, bits // 2
+        with np.errstate(invalid='ignore'):
+            x = np.clip(np.floor((np.nan_to_num(lon) + 180.0) / 360.0 * (1 << lon_bits)), 0, (1 << lon_bits) - 1)
+            y = np.clip(np.floor((np.nan_to_num(lat) + 90.0) / 180.0 * (1 << lat_bits)), 0, (1 << lat_bits) - 1)
+        x, y = x.astype(np.int64), y.astype(np.int64)
+        codes = np.zeros(np.shape(x), dtype=np.int64)
+        for i in range(bits):
+            # Bit i from the top alternates lon, lat, lon, ...
+            source, bit = (x, lon_bits - 1 - i // 2) if i % 2 == 0 else (y, lat_bits - 1 - i // 2)
+            codes |= ((source >> bit) & 1) << (bits - 1 - i)
+        return np.where(np.isnan(lat) | np.isnan(lon), -1, codes)
+
+    def _buckets(self):
+        if self._sorted_codes is None:
+            codes = self.geohash(self.lat[:self.size], self.lon[:self.size])
+            order = np.argsort(codes, kind='stable')
+            self._sorted_codes = codes[order]
+            self._rank = np.empty(self.size, dtype=np.int64)
+            self._rank[order] = np.arange(self.size)
+        return self._sorted_codes, self._rank
+
+    def same_cell(self, lat: np.ndarray, lon: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Whether each row lies in the geohash cell of the matching (lat, lon) point"""
+        sorted_codes, rank = self._buckets()
+        codes = self.geohash(lat, lon)
+        start = np.searchsorted(sorted_codes, codes, side='left')
+        end = np.searchsorted(sorted_codes, codes, side='right')
+        return (codes >= 0) & (rank[rows] >= start) & (rank[rows] < end)
+
+    def distance_km(self, lat: np.ndarray, lon: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Haversine distance from each (lat, lon) point to the matching row; NaN without coordinates"""
+        lat1, lon1 = np.radians(lat), np.radians(lon)
+        lat2, lon2 = np.radians(self.lat[rows]), np.radians(self.lon[rows])
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        return 2 * self.EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class QueryAnalysis:
+    """Query-level facts shared by every row and feature family of a query"""
+
+    __slots__ = ('normalized', 'token_set', 'token_ids', 'word_count', 'complexity_score',
+                 'bedrooms', 'bathrooms', 'has_location_intent')
+
+    def __init__(self, **values):
+        for name, value in values.items():
+            setattr(self, name, value)
+
+
+class QueryAnalyzer:
+    """Parses a query once and memoizes the result by normalized text
+
+    Everything here is invariant under lowercasing and whitespace collapsing; query
+    tokens are mapped into the vocabulary shared with DocumentTokenIndex.
+    """
+
+    BEDROOMS_PATTERN = re.compile(r'(\d+)[\s-]*(?:bed|bedroom)')
+    BATHROOMS_PATTERN = re.compile(r'(\d+)[\s-]*(?:bath|bathroom)')
+    LOCATION_WORDS = ('near', 'downtown', 'city', 'neighborhood', 'area')
+
+    def __init__(self, vocab: Optional[Dict[str, int]] = None):
+        self.vocab = vocab if vocab is not None else {}
+        self._memo = {}
+
+    def analyze(self, query: str) -> QueryAnalysis:
+        normalized = ' '.join((query or '').lower().split())
+        analysis = self._memo.get(normalized)
+        if analysis is not None:
+            return analysis
+        tokens = normalized.split()
+        token_set = set(tokens)
+        bedrooms = self.BEDROOMS_PATTERN.search(normalized)
+        bathrooms = self.BATHROOMS_PATTERN.search(normalized)
+        analysis = self._memo[normalized] = QueryAnalysis(
+            normalized=normalized,
+            token_set=token_set,
+            token_ids=np.array([self.vocab.setdefault(token, len(self.vocab)) for token in sorted(token_set)],
+                               dtype=np.int64),
+            word_count=len(tokens),
+            complexity_score=0.8 if len(tokens) > 3 else 0.5,
+            bedrooms=int(bedrooms.group(1)) if bedrooms else 0,
+            bathrooms=int(bathrooms.group(1)) if bathrooms else 0,
+            has_location_intent=any(word in normalized for word in self.LOCATION_WORDS)
+        )
+        return analysis
+
+
+class DocumentTokenIndex:
+    """Per-document token-id sets of the matching-feature text fields over a shared vocabulary
+
+    Tokens are lower().split(), exactly as calculate_query_document_matching splits
+    them. Each field becomes a binary CSR matrix (documents x vocabulary), so the
+    query-token overlap of a whole batch of documents is one sparse matrix-vector
+    product. Documents with non-string text fields are flagged irregular.
+    """
+
+    FIELDS = ('property-description', 'property-features')
+    TEXT_FIELDS = ('title', 'property-description', 'property-features', 'property-status')
+
+    def __init__(self):
+        self.vocab = {}
+        self.doc_index = {}
+        self._token_ids = {field: [] for field in self.FIELDS}
+        self._matrices = {}
+        self.status_relevance = []
+        self.irregular = []
+
+    def __len__(self) -> int:
+        return len(self.irregular)
+
+    def add(self, doc_id: str, source: dict) -> int:
+        row = self.doc_index.get(doc_id)
+        if row is not None:
+            return row
+        row = self.doc_index[doc_id] = len(self.irregular)
+        irregular = any(not isinstance(source.get(field, ''), str) for field in self.TEXT_FIELDS)
+        for field in self.FIELDS:
+            text = source.get(field, '') if not irregular else ''
+            token_ids = [self.vocab.setdefault(token, len(self.vocab)) for token in text.lower().split()]
+            self._token_ids[field].append(np.unique(np.asarray(token_ids, dtype=np.int32)))
+        status = source.get('property-status', '').lower() if not irregular else ''
+        self.status_relevance.append(1.0 if 'active' in status or 'available' in status else 0.7)
+        self.irregular.append(irregular)
+        self._matrices = {}
+        return row
+
+    def _matrix(self, field: str):
+        matrix = self._matrices.get(field)
+        if matrix is None:
+            token_ids = self._token_ids[field]
+            indptr = np.zeros(len(token_ids) + 1, dtype=np.int64)
+            np.cumsum([len(ids) for ids in token_ids], out=indptr[1:])
+            indices = np.concatenate(token_ids) if token_ids else np.zeros(0, dtype=np.int32)
+            matrix = self._matrices[field] = sparse.csr_matrix(
+                (np.ones(len(indices), dtype=np.float64), indices, indptr), shape=(len(token_ids), len(self.vocab))
+            )
+        return matrix
+
+    def query_overlap(self, analysis: 'QueryAnalysis', rows: np.ndarray) -> Dict[str, np.ndarray]:
+        """|query tokens & field tokens| / max(|query tokens|, 1) per field for the given rows"""
+        overlap = {}
+        for field in self.FIELDS:
+            matrix = self._matrix(field)
+            # Query-only tokens may have joined the vocabulary after the matrix was built; no document has them
+            indicator = np.zeros(matrix.shape[1], dtype=np.float64)
+            indicator[analysis.token_ids[analysis.token_ids < matrix.shape[1]]] = 1.0
+            overlap[field] = (matrix[rows] @ indicator) / max(len(analysis.token_set), 1)
+        return overlap
+
+
+class AhoCorasickMatcher:
+    """Aho-Corasick automaton over a set of patterns
+
+    scan() walks a text once and returns the ids of every pattern that occurs in it
+    as a substring (the empty pattern occurs in every text, like "" in s).
+    """
+
+    def __init__(self, patterns: List[str]):
+        self.patterns = list(patterns)
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        self._always = [pid for pid, pattern in enumerate(self.patterns) if not pattern]
+        for pid, pattern in enumerate(self.patterns):
+            node = 0
+            for ch in pattern:
+                child = self._goto[node].get(ch)
+                if child is None:
+                    child = self._goto[node][ch] = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = child
+            if pattern:
+                self._out[node].append(pid)
+        # Breadth-first failure links; each node also reports the patterns of its failure chain
+        pending = deque(self._goto[0].values())
+        while pending:
+            node = pending.popleft()
+            for ch, child in self._goto[node].items():
+                pending.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def scan(self, text: str) -> set:
+        matched = set(self._always)
+        node = 0
+        for ch in text:
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            if self._out[node]:
+                matched.update(self._out[node])
+        return matched
+
+
+class LocalBM25Index:
+    """In-process per-field BM25 over the property corpus
+
+    Postings are CSR-style NumPy arrays per field (term -> sorted doc rows + term
+    frequencies) with Lucene's quantized length norms and BM25 formula
+    (idf = ln(1 + (N - df + 0.5) / (df + 0.5)), tf / (tf + k1 * (1 - b + b * dl / avgdl))).
+    Tokens approximate the standard analyzer; seeding from mtermvectors replaces the
+    seeded documents' terms and the corpus statistics with the cluster's own.
+    """
+
+    TOKEN_PATTERN = re.compile(r"\d+(?:[.,]\d+)+|\w+(?:['’.]\w+)*")
+
+    def __init__(self, fields=BM25_FIELDS, k1: float = 1.2, b: float = 0.75):
+        self.fields = fields
+        self.k1 = k1
+        self.b = b
+        self.doc_ids = []
+        self.doc_index = {}
+        self._term_counts = {field: [] for field, _, _ in fields}  # per field: one Counter per doc row
+        self._seeded_stats = {field: {'doc_freq': {}} for field, _, _ in fields}
+        self._postings = {}
+
+    @classmethod
+    def from_jsonl(cls, path: str, id_field: Optional[str] = None, **kwargs) -> 'LocalBM25Index':
+        """Index a properties JSONL file, keying documents like FileDataSource does"""
+        index = cls(**kwargs)
+        with open(path, 'r') as f:
+            for line_no, line in enumerate(f):
+                line = line.strip()
+                if line:
+                    doc = json.loads(line)
+                    doc_id = FileDataSource.property_id(doc, line_no, id_field)
+                    if doc_id is not None:
+                        index.add_document(doc_id, doc)
+        index.build()
+        return index
+
+    @classmethod
+    def from_documents(cls, documents, **kwargs) -> 'LocalBM25Index':
+        """Index (doc_id, _source) pairs, e.g. an index scan keyed by the cluster ids events refer to"""
+        index = cls(**kwargs)
+        for doc_id, source in documents:
+            index.add_document(doc_id, source)
+        index.build()
+        return index
+
+    @classmethod
+    def analyze(cls, text) -> List[str]:
+        if isinstance(text, (list, tuple)):
+            text = ' '.join(str(value) for value in text)
+        return cls.TOKEN_PATTERN.findall(str(text or '').lower())
+
+    def _row(self, doc_id: str) -> int:
+        row = self.doc_index.get(doc_id)
+        if row is None:
+            row = self.doc_index[doc_id] = len(self.doc_ids)
+            self.doc_ids.append(doc_id)
+            for counts in self._term_counts.values():
+                counts.append(Counter())
+        return row
+
+    def add_document(self, doc_id: str, source: dict):
+        row = self._row(doc_id)
+        for field, _, _ in self.fields:
+            self._term_counts[field][row] = Counter(self.analyze(source.get(field)))
+
+    def seed_from_termvectors(self, es_client, doc_ids: List[str], index: str = 'properties', batch_size: int = 100) -> int:
+        """Take term frequencies and corpus statistics for doc_ids from the cluster's term vectors"""
+        seeded = 0
+        doc_ids = list(doc_ids)
+        for i in range(0, len(doc_ids), batch_size):
+            response = es_client.mtermvectors(
+                index=index,
+                ids=doc_ids[i:i + batch_size],
+                fields=[field for field, _, _ in self.fields],
+                term_statistics=True,
+                field_statistics=True,
+                positions=False,
+                offsets=False,
+                payloads=False
+            )
+            for doc in response.get('docs', []):
+                if not doc.get('found'):
+                    continue
+                row = self._row(doc['_id'])
+                for field, _, _ in self.fields:
+                    vector = doc.get('term_vectors', {}).get(field)
+                    if vector is None:
+                        self._term_counts[field][row] = Counter()
+                        continue
+                    stats = self._seeded_stats[field]
+                    stats.update(vector.get('field_statistics', {}))
+                    self._term_counts[field][row] = Counter({
+                        term: info.get('term_freq', 1) for term, info in vector.get('terms', {}).items()
+                    })
+                    for term, info in vector.get('terms', {}).items():
+                        if 'doc_freq' in info:
+                            stats['doc_freq'][term] = info['doc_freq']
+                seeded += 1
+        self.build()
+        return seeded
+
+    @staticmethod
+    def _int_to_byte4(value: int) -> int:
+        # Lucene SmallFloat.intToByte4: exact below 24, 4 significant bits above
+        if value < 24:
+            return value
+        value -= 24
+        num_bits = value.bit_length()
+        if num_bits < 4:
+            return 24 + value
+        shift = num_bits - 4
+        return 24 + (((value >> shift) & 0x07) | ((shift + 1) << 3))
+
+    @staticmethod
+    def _byte4_to_int(encoded: int) -> int:
+        if encoded < 24:
+            return encoded
+        encoded -= 24
+        bits, shift = encoded & 0x07, (encoded >> 3) - 1
+        return 24 + (bits if shift == -1 else (bits | 0x08) << shift)
+
+    def build(self):
+        """(Re)build the NumPy postings from the per-document term counts"""
+        for field, _, _ in self.fields:
+            vocab = {}
+            terms, rows, freqs = [], [], []
+            lengths = np.zeros(len(self.doc_ids), dtype=np.int64)
+            for row, counts in enumerate(self._term_counts[field]):
+                for term, tf in counts.items():
+                    terms.append(vocab.setdefault(term, len(vocab)))
+                    rows.append(row)
+                    freqs.append(tf)
+                lengths[row] = sum(counts.values())
+            terms = np.asarray(terms, dtype=np.int64)
+            rows = np.asarray(rows, dtype=np.int64)
+            order = np.lexsort((rows, terms))
+            df = np.bincount(terms, minlength=len(vocab)).astype(np.float64)
+
+            stats = self._seeded_stats[field]
+            for term, doc_freq in stats['doc_freq'].items():
+                if term in vocab:
+                    df[vocab[term]] = doc_freq
+            doc_count = stats.get('doc_count') or int((lengths > 0).sum())
+            sum_ttf = stats.get('sum_ttf') or int(lengths.sum())
+            decoded = np.array([self._byte4_to_int(self._int_to_byte4(int(n))) for n in lengths], dtype=np.float64)
+
+            self._postings[field] = {
+                'vocab': vocab,
+                'offsets': np.concatenate(([0], np.cumsum(np.bincount(terms, minlength=len(vocab))))),
+                'docs': rows[order],
+                'tf': np.asarray(freqs, dtype=np.float64)[order],
+                'idf': np.log(1.0 + (doc_count - df + 0.5) / (df + 0.5)),
+                'doc_len': decoded,
+                'avgdl': sum_ttf / doc_count if doc_count else 1.0
+            }
+
+    def score_fields(self, query: str, doc_ids: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Boosted per-field BM25 scores (len(doc_ids) x fields) and a mask of indexed documents"""
+        rows = np.array([self.doc_index.get(doc_id, -1) for doc_id in doc_ids], dtype=np.int64)
+        known = rows >= 0
+        scores = np.zeros((len(doc_ids), len(self.fields)), dtype=np.float64)
+        terms = self.analyze(query)
+        if not terms or not known.any():
+            return scores, known
+        target = rows[known]
+        for f, (field, boost, _) in enumerate(self.fields):
+            postings = self._postings[field]
+            norm = self.k1 * (1 - self.b + self.b * postings['doc_len'][target] / postings['avgdl'])
+            field_scores = np.zeros(len(target), dtype=np.float64)
+            for term in terms:  # repeated query terms score repeatedly, like the match query's should clauses
+                t = postings['vocab'].get(term)
+                if t is None:
+                    continue
+                start, end = postings['offsets'][t], postings['offsets'][t + 1]
+                docs = postings['docs'][start:end]
+                pos = np.minimum(np.searchsorted(docs, target), len(docs) - 1)
+                tf = np.where(docs[pos] == target, postings['tf'][start:end][pos], 0.0)
+                field_scores += postings['idf'][t] * tf / (tf + norm)
+            scores[known, f] = boost * field_scores
+        return scores, known
+
+    def score(self, query: str, doc_ids: List[str]) -> Dict[str, Dict[str, float]]:
+        """BM25 feature dicts (as get_bm25_scores_batch returns) for the indexed documents among doc_ids"""
+        scores, known = self.score_fields(query, doc_ids)
+        result = {}
+        for i in np.flatnonzero(known):
+            doc_scores = {feature: float(scores[i, f]) for f, (_, _, feature) in enumerate(self.fields)}
+            doc_scores['bm25_combined_score'] = float(scores[i].max())
+            result[doc_ids[i]] = doc_scores
+        return result
+
+
+class PropertyEmbeddingEncoder:
+    """sentence-transformers encoder returning L2-normalized float32 embeddings
+
+    E5 models expect "query: " / "passage: " prefixes, which are added automatically.
+    quantize=True applies torch dynamic int8 quantization to the Linear layers (CPU).
+    With a token_budget, texts are sorted by token length and batched so that
+    batch size x longest text stays within the budget: short texts share large
+    batches instead of being padded to the longest text of a fixed-size batch.
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 64, device: str = 'cpu',
+                 quantize: bool = False, token_budget: int = 0):
+        if SentenceTransformer is None:
+            raise ImportError("sentence-transformers is required for local semantic features")
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.token_budget = token_budget
+        self.model = SentenceTransformer(model_name, device=device)
+        if quantize:
+            import torch
+            self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.variant = 'int8' if quantize else 'fp32'
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self._prefixed = 'e5' in model_name.lower()
+
+    def _encode_batch(self, texts: List[str], batch_size: int) -> np.ndarray:
+        return self.model.encode(
+            texts,
+            batch_size=batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        ).astype(np.float32)
+
+    def encode(self, texts: List[str], kind: str = 'passage') -> np.ndarray:
+        if self._prefixed:
+            texts = [f"{kind}: {text}" for text in texts]
+        if not self.token_budget or len(texts) <= 1:
+            return self._encode_batch(texts, self.batch_size)
+        lengths = [
+            len(ids) for ids in
+            self.model.tokenizer(texts, truncation=True, max_length=self.model.max_seq_length)['input_ids']
+        ]
+        embeddings = np.empty((len(texts), self.dim), dtype=np.float32)
+        batch = []
+        for i in np.argsort(lengths, kind='stable'):
+            # Ascending order: the text being added is the longest (padded length) of the batch
+            if batch and (len(batch) + 1) * lengths[i] > self.token_budget:
+                embeddings[batch] = self._encode_batch([texts[j] for j in batch], len(batch))
+                batch = []
+            batch.append(i)
+        embeddings[batch] = self._encode_batch([texts[j] for j in batch], len(batch))
+        return embeddings
+
+
+class QueryEmbeddingCache:
+    """Query embeddings keyed by (model, whitespace-collapsed query text)
+
+    An LRU dict in memory in front of a SQLite table that survives runs; new
+    embeddings are buffered and written to disk on flush().
+    """
+
+    def __init__(self, path: str, model_name: str, capacity: int = 10000, flush_rows: int = 1000):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.model_name = model_name
+        self.capacity = capacity
+        self.flush_rows = flush_rows
+        self._memory = OrderedDict()
+        self._pending = {}
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS query_embeddings ('
+            ' model TEXT NOT NULL, query TEXT NOT NULL, embedding BLOB NOT NULL,'
+            ' PRIMARY KEY (model, query))'
+        )
+        self.conn.commit()
+
+    def _remember(self, query: str, vector: np.ndarray):
+        self._memory[query] = vector
+        self._memory.move_to_end(query)
+        while len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
+
+    def get(self, query: str) -> Optional[np.ndarray]:
+        vector = self._memory.get(query)
+        if vector is not None:
+            self._memory.move_to_end(query)
+            self.stats['memory_hits'] += 1
+            return vector
+        vector = self._pending.get(query)
+        if vector is None:
+            row = self.conn.execute(
+                'SELECT embedding FROM query_embeddings WHERE model = ? AND query = ?', (self.model_name, query)
+            ).fetchone()
+            vector = np.frombuffer(row[0], dtype=np.float32) if row else None
+        if vector is None:
+            self.stats['misses'] += 1
+            return None
+        self.stats['disk_hits'] += 1
+        self._remember(query, vector)
+        return vector
+
+    def put(self, query: str, vector: np.ndarray):
+        vector = np.ascontiguousarray(vector, dtype=np.float32)
+        self._remember(query, vector)
+        self._pending[query] = vector
+        if len(self._pending) >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?)',
+            [(self.model_name, query, vector.tobytes()) for query, vector in self._pending.items()]
+        )
+        self.conn.commit()
+        self._pending = {}
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+class PropertyEmbeddingMatrix:
+    """Memory-mapped property embeddings with a doc id -> row index
+
+    Layout: <root>/<field>.npy (rows x dim, L2-normalized, zero rows for empty text)
+    and <root>/embedding_index.json (model, encoder variant, storage, dim, doc ids in
+    row order). With int8 storage each row is stored as round(x / scale) with its
+    scale = max|x| / 127 in <root>/<field>.scale.npy.
+    """
+
+    FIELDS = {
+        'property-description': 'semantic_description_similarity',
+        'property-features': 'semantic_features_similarity'
+    }
+    INDEX_FILE = 'embedding_index.json'
+
+    def __init__(self, root: str, model_name: str, doc_ids: List[str], matrices: Dict[str, np.ndarray],
+                 scales: Optional[Dict[str, np.ndarray]] = None, encoder_variant: str = 'fp32'):
+        self.root = root
+        self.model_name = model_name
+        self.encoder_variant = encoder_variant
+        self.scales = scales
+        self.storage = 'int8' if scales else 'float32'
+        self.doc_ids = doc_ids
+        self.doc_index = {doc_id: row for row, doc_id in enumerate(doc_ids)}
+        self.matrices = matrices
+        # Documents without text for a field never match it on the cluster either
+        self.has_text = {field: np.any(matrix != 0, axis=1) for field, matrix in matrices.items()}
+
+    @classmethod
+    def exists(cls, root: str) -> bool:
+        return os.path.exists(os.path.join(root, cls.INDEX_FILE))
+
+    @classmethod
+    def load(cls, root: str) -> 'PropertyEmbeddingMatrix':
+        with open(os.path.join(root, cls.INDEX_FILE), 'r') as f:
+            index = json.load(f)
+        matrices = {field: np.load(os.path.join(root, f"{field}.npy"), mmap_mode='r') for field in cls.FIELDS}
+        scales = None
+        if index.get('storage') == 'int8':
+            scales = {field: np.load(os.path.join(root, f"{field}.scale.npy")) for field in cls.FIELDS}
+        return cls(root, index['model'], index['doc_ids'], matrices, scales, index.get('encoder', 'fp32'))
+
+    @staticmethod
+    def quantize_rows(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Symmetric per-row int8 quantization: vectors ~= codes * scale[:, None]"""
+        scale = np.abs(vectors).max(axis=1) / 127.0
+        safe = np.where(scale > 0, scale, 1.0)
+        codes = np.clip(np.rint(vectors / safe[:, None]), -127, 127).astype(np.int8)
+        return codes, scale.astype(np.float32)
+
+    @classmethod
+    def build(cls, root: str, encoder: PropertyEmbeddingEncoder, documents: List[Tuple[str, dict]],
+              chunk_size: int = 1024, storage: str = 'float32') -> 'PropertyEmbeddingMatrix':
+        """Encode every document's semantic fields into fresh memory-mapped matrices"""
+        os.makedirs(root, exist_ok=True)
+        int8 = storage == 'int8'
+        for field in cls.FIELDS:
+            matrix = np.lib.format.open_memmap(
+                os.path.join(root, f"{field}.npy"), mode='w+',
+                dtype=np.int8 if int8 else np.float32, shape=(len(documents), encoder.dim)
+            )
+            scales = np.zeros(len(documents), dtype=np.float32)
+            for start in range(0, len(documents), chunk_size):
+                chunk = documents[start:start + chunk_size]
+                texts = [str(source.get(field) or '').strip() for _, source in chunk]
+                rows = [i for i, text in enumerate(texts) if text]
+                matrix[start:start + len(chunk)] = 0
+                if rows:
+                    vectors = encoder.encode([texts[i] for i in rows])
+                    target = [start + i for i in rows]
+                    if int8:
+                        matrix[target], scales[target] = cls.quantize_rows(vectors)
+                    else:
+                        matrix[target] = vectors
+            matrix.flush()
+            del matrix
+            if int8:
+                np.save(os.path.join(root, f"{field}.scale.npy"), scales)
+        with open(os.path.join(root, cls.INDEX_FILE), 'w') as f:
+            json.dump({
+                'model': encoder.model_name,
+                'encoder': encoder.variant,
+                'storage': 'int8' if int8 else 'float32',
+                'dim': encoder.dim,
+                'doc_ids': [doc_id for doc_id, _ in documents],
+                'built_at': datetime.now(timezone.utc).isoformat()
+            }, f)
+        return cls.load(root)
+
+    def similarities(self, query_vector: np.ndarray, doc_ids: List[str]) -> Dict[str, Dict[str, float]]:
+        """Semantic features for the embedded documents among doc_ids with one matrix-vector product per field
+
+        Cosine similarity is mapped to (1 + cos) / 2, the _score of a dense semantic_text match on the
+        cluster, whose semantic searches filter on the document ids so nothing else adds to the score.
+        """
+        rows = np.array([self.doc_index.get(doc_id, -1) for doc_id in doc_ids], dtype=np.int64)
+        known = np.flatnonzero(rows >= 0)
+        field_scores = {}
+        for field, feature in self.FIELDS.items():
+            target = rows[known]
+            cosine = np.asarray(self.matrices[field][target], dtype=np.float32) @ query_vector
+            if self.scales is not None:
+                cosine *= self.scales[field][target]
+            field_scores[feature] = np.where(self.has_text[field][target], (1.0 + cosine) / 2.0, 0.0)
+        similarities = {}
+        for i, position in enumerate(known):
+            desc_score = float(field_scores['semantic_description_similarity'][i])
+            features_score = float(field_scores['semantic_features_similarity'][i])
+            similarities[doc_ids[position]] = {
+                "semantic_description_similarity": desc_score,
+                "semantic_features_similarity": features_score,
+                "semantic_query_embedding_match": (desc_score + features_score) / 2.0
+            }
+        return similarities
+
+
+class LTRDataSource(ABC):
+    """Source of events and property documents for training
+
+    The trainer talks to the live cluster when no data source is configured; a data
+    source lets the same pipeline run against other backends. Events are returned as
+    hits ({'_id', '_source'}) whose _source uses the nested custom.* shape the
+    Elasticsearch logger produces.
+    """
+
+    name = 'base'
+
+    @abstractmethod
+    def check(self) -> bool:
+        """Whether the source is usable, printing why not"""
+
+    @abstractmethod
+    def count_events(self, action_type: str) -> int:
+        """Number of events of an action type"""
+
+    @abstractmethod
+    def stream_events(self, action_type: str):
+        """Yield every event hit of an action type"""
+
+    @abstractmethod
+    def property_exists(self, doc_id: str) -> bool:
+        """Whether a property document exists"""
+
+    @abstractmethod
+    def get_property(self, doc_id: str) -> Optional[dict]:
+        """A property _source by id, None if unknown"""
+
+
+class FileDataSource(LTRDataSource):
+    """Offline data source reading event dumps (JSONL/Parquet) and a properties JSONL file
+
+    Events may be in the flat event.schema shape ("event.action", "session.id", ...),
+    the nested custom.* shape of the data stream, or raw search hits with a _source.
+    Properties are keyed by `id_field` when given (e.g. the cluster _id exported with
+    each document), else by their "_id"/"id" field when present, otherwise by line
+    number, so events must reference properties the same way.
+    """
+
+    name = 'files'
+
+    def __init__(self, events_path: str, properties_path: str, id_field: Optional[str] = None):
+        self.events_path = events_path
+        self.properties_path = properties_path
+        self.id_field = id_field
+        self._properties = None
+
+    @staticmethod
+    def property_id(doc: dict, line_no: int, id_field: Optional[str] = None) -> Optional[str]:
+        """Id of a properties JSONL document; None when `id_field` is set but missing"""
+        if id_field:
+            value = doc.get(id_field)
+            return str(value) if value is not None else None
+        return str(doc.get('_id', doc.get('id', line_no)))
+
+    def _event_files(self):
+        if os.path.isdir(self.events_path):
+            return sorted(
+                os.path.join(root, name)
+                for root, _, names in os.walk(self.events_path)
+                for name in names
+                if name.endswith(('.jsonl', '.json', '.parquet'))
+            )
+        return [self.events_path]
+
+    def _read_records(self, path):
+        if path.endswith('.parquet'):
+            if pq is None:
+                raise ImportError("pyarrow is required to read Parquet event dumps")
+            for batch in pq.ParquetFile(path).iter_batches():
+                yield from batch.to_pylist()
+            return
+        with open(path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+    def normalize_event(self, record: dict, fallback_id: str) -> dict:
+        """Convert an event record into a hit with a nested custom.* _source"""
+        event_id = record.get('_id', fallback_id)
+        if '_source' in record:
+            record = record['_source']
+        if 'custom' in record:
+            return {'_id': event_id, '_source': record}
+        custom = {}
+        for key, value in record.items():
+            if key == '@timestamp':
+                continue
+            node = custom
+            parts = key.split('.')
+            for part in parts[:-1]:
+                node = node.setdefault(part, {})
+            node[parts[-1]] = value
+        return {'_id': event_id, '_source': {'@timestamp': record.get('@timestamp'), 'custom': custom}}
+
+    def stream_events(self, action_type: str):
+        for path in self._event_files():
+            for line_no, record in enumerate(self._read_records(path)):
+                hit = self.normalize_event(record, f"{os.path.basename(path)}:{line_no}")
+                if hit['_source'].get('custom', {}).get('event', {}).get('action') == action_type:
+                    yield hit
+
+    def count_events(self, action_type: str) -> int:
+        return sum(1 for _ in self.stream_events(action_type))
+
+    def _load_properties(self):
+        if self._properties is None:
+            self._properties = {}
+            unkeyed = 0
+            with open(self.properties_path, 'r') as f:
+                for line_no, line in enumerate(f):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    doc = json.loads(line)
+                    doc_id = self.property_id(doc, line_no, self.id_field)
+                    if doc_id is None:
+                        unkeyed += 1
+                        continue
+                    doc.pop('_id', None)
+                    self._properties[doc_id] = doc
+            print(f"✅ Loaded {len(self._properties)} properties from {self.properties_path}")
+            if unkeyed:
+                print(f"⚠️  Skipped {unkeyed} properties without a '{self.id_field}' field")
+        return self._properties
+
+    def check(self) -> bool:
+        missing = [p for p in (self.events_path, self.properties_path) if not os.path.exists(p)]
+        if missing:
+            print(f"❌ Offline data not found: {', '.join(missing)}")
+            return False
+        print(f"✅ Offline mode: events from {self.events_path}, properties from {self.properties_path}")
+        return True
+
+    def property_exists(self, doc_id: str) -> bool:
+        return doc_id in self._load_properties()
+
+    def get_property(self, doc_id: str) -> Optional[dict]:
+        return self._load_properties().get(doc_id)
+
+
 class UnifiedDataStreamLTRTrainer:
     """XGBoost LTR trainer using the unified data stream"""
     
-    def __init__(self):
+    def __init__(self, slices: Optional[int] = None, full_refresh: bool = False,
+                 extraction_mode: Optional[str] = None, offline: bool = False,
+                 properties_id_field: Optional[str] = None):
         # Configuration from .env
         self.elastic_url = os.getenv('ELASTIC_URL')
         self.elastic_api_key = os.getenv('ELASTIC_API_KEY')
@@ -63,8 +1414,21 @@ class UnifiedDataStreamLTRTrainer:
         self.models_dir = os.getenv('LTR_MODEL_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models'))
         print(f"DEBUG: Using self.models_dir={self.models_dir}")
 
+        # Offline mode reads events and properties from files instead of the cluster
+        project_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.properties_file = os.getenv('LTR_OFFLINE_PROPERTIES', os.path.join(project_dir, 'data', 'properties.jsonl'))
+        # Field of the properties file holding the document id events refer to (default: _id/id, else line number)
+        self.properties_id_field = properties_id_field or os.getenv('LTR_OFFLINE_PROPERTIES_ID_FIELD') or None
+        self.data_source = None
+        if offline:
+            self.data_source = FileDataSource(
+                events_path=os.getenv('LTR_OFFLINE_EVENTS', os.path.join(self.models_dir, 'events')),
+                properties_path=self.properties_file,
+                id_field=self.properties_id_field
+            )
+
         # Initialize Elasticsearch client
-        self.es_client = Elasticsearch(
+        self.es_client = None if offline else Elasticsearch(
             self.elastic_url,
             api_key=self.elastic_api_key,
             verify_certs=True
@@ -148,12 +1512,134 @@ class UnifiedDataStreamLTRTrainer:
         ]
         
         self.training_examples = []
-        self.property_cache = {}  # Add a cache for property documents
-        self.property_exists_cache = {}  # Cache for property existence checks
+        # Byte-bounded LRU cache for property documents
+        spill = os.getenv('LTR_PROPERTY_CACHE_SPILL', 'false').lower() == 'true'
+        self.property_cache = PropertyCache(
+            max_bytes=int(float(os.getenv('LTR_PROPERTY_CACHE_MB', 256)) * 1024 * 1024),
+            spill_path=os.path.join(self.models_dir, 'property_cache_spill.sqlite') if spill else None
+        )
+        # Property membership resolved in batches: ids known to exist / every id already checked
+        self.existing_property_ids = set()
+        self.resolved_property_ids = set()
+        self.membership_batch_size = int(os.getenv('LTR_MEMBERSHIP_BATCH_SIZE', 5000))
+        # Bulk property prefetch (mget) before feature enrichment
+        self.mget_batch_size = int(os.getenv('LTR_MGET_BATCH_SIZE', 500))
+        self.mget_concurrency = int(os.getenv('LTR_MGET_CONCURRENCY', 4))
+        # Compute the BM25/semantic/attribute/geo/matching features for training rows (opt-in: the
+        # baseline trains with those columns unfilled, and enrichment issues extra searches per run)
+        self.enrich_property_features = os.getenv('LTR_ENRICH_PROPERTY_FEATURES', 'false').lower() == 'true'
+        self.enrich_batch_size = int(os.getenv('LTR_ENRICH_BATCH_SIZE', 500))
+        self.msearch_max_bytes = int(os.getenv('LTR_MSEARCH_MAX_BYTES', 1048576))
+
+        # cluster = BM25 features from Elasticsearch, local = in-process index over the properties file
+        self.bm25_engine = os.getenv('LTR_BM25_ENGINE', 'cluster').lower()
+        self.bm25_seed_termvectors = os.getenv('LTR_BM25_SEED_TERMVECTORS', 'false').lower() == 'true'
+        self.local_bm25 = None  # built on first use by _ensure_local_bm25
+
+        # cluster = semantic_text searches, local = precomputed embedding matrix (see build-embeddings)
+        self.semantic_engine = os.getenv('LTR_SEMANTIC_ENGINE', 'cluster').lower()
+        self.embeddings_dir = os.getenv('LTR_EMBEDDINGS_DIR', os.path.join(self.models_dir, 'embeddings'))
+        self.embedding_model = os.getenv('LTR_EMBEDDING_MODEL', 'intfloat/multilingual-e5-small')
+        self.embedding_quantize = os.getenv('LTR_EMBEDDING_QUANTIZE', 'false').lower() == 'true'
+        self.embedding_storage = os.getenv('LTR_EMBEDDING_STORAGE', 'float32').lower()
+        self.embedding_token_budget = int(os.getenv('LTR_EMBEDDING_TOKEN_BUDGET', 8192))
+        self.local_semantic = None
+        self._query_encoder = None
+        self.query_embedding_cache = None
+        if self.semantic_engine == 'local':
+            if PropertyEmbeddingMatrix.exists(self.embeddings_dir):
+                self.local_semantic = PropertyEmbeddingMatrix.load(self.embeddings_dir)
+                print(f"🧭 Local semantic features: {len(self.local_semantic.doc_ids)} embedded properties "
+                      f"({self.local_semantic.model_name}, {self.local_semantic.encoder_variant} encoder, "
+                      f"{self.local_semantic.storage} storage)")
+                self.query_embedding_cache = QueryEmbeddingCache(
+                    os.path.join(self.embeddings_dir, 'query_embeddings.sqlite'),
+                    f"{self.local_semantic.model_name}:{self.local_semantic.encoder_variant}",
+                    capacity=int(os.getenv('LTR_QUERY_CACHE_SIZE', 10000))
+                )
+            else:
+                print(f"⚠️  No property embeddings in {self.embeddings_dir}; run build-embeddings. "
+                      f"Using cluster semantic search")
+
+        self.feature_store = None
+        if os.getenv('LTR_FEATURE_STORE', 'true').lower() == 'true':
+            # Local and cluster BM25 scores differ, so each engine keeps its own bm25 rows
+            versions = {family: str(version) for family, version in FEATURE_FAMILY_VERSIONS.items()}
+            versions['bm25'] = f"{versions['bm25']}-{self.bm25_engine}"
+            if self.local_semantic is not None:
+                versions['semantic'] = (f"{versions['semantic']}-local-{self.local_semantic.model_name}-"
+                                        f"{self.local_semantic.encoder_variant}-{self.local_semantic.storage}")
+            self.feature_store = FeatureStore(
+                os.path.join(self.models_dir, 'feature_store.sqlite'),
+                versions,
+                flush_rows=int(os.getenv('LTR_FEATURE_STORE_FLUSH_ROWS', 5000))
+            )
+        self.planned_property_features = {}  # (normalized query, doc_id) -> property features
+        # Columnar numeric attributes for the attribute feature family (built on first use)
+        self.use_attribute_store = os.getenv('LTR_ATTRIBUTE_STORE', 'true').lower() == 'true'
+        self.attribute_store = None
+        # Token-id sets of description/features text for the matching feature family
+        self.use_token_index = os.getenv('LTR_TOKEN_INDEX', 'true').lower() == 'true'
+        self.token_index = DocumentTokenIndex()
+        self.query_analyzer = QueryAnalyzer(vocab=self.token_index.vocab)
+        # Coordinates + geohash buckets for distance features of geo-filtered sessions (built on first use)
+        self.geohash_precision = int(os.getenv('LTR_GEOHASH_PRECISION', 6))
+        self.geo_index = None
+        self.planned_geo_features = {}  # (session_id, doc_id) -> geo features
+        # Exact title hits of the current plan's match_titles pass: doc_id -> lowercased queries contained in its
+        # title; only (pattern, doc) pairs from the same pass are answered from here
+        self.title_matches = {}
+        self.title_match_patterns = set()
+
+        # Per-call payload accounting (call label -> calls / response bytes)
+        self.payload_stats = {}
+        self._payload_lock = threading.Lock()
+
+        # Event extraction paging (point-in-time + search_after)
+        self.extract_page_size = int(os.getenv('LTR_EXTRACT_PAGE_SIZE', 5000))
+        self.pit_keep_alive = os.getenv('LTR_PIT_KEEP_ALIVE', '2m')
+        # Number of PIT slices drained concurrently (1 = single cursor)
+        self.extract_slices = max(1, slices or int(os.getenv('LTR_EXTRACT_SLICES', 1)))
+        # 'stream' pulls raw search_result_logged hits; 'composite' builds the session lookups server-side
+        self.extraction_mode = extraction_mode or os.getenv('LTR_EXTRACTION_MODE', 'stream')
+        if offline and self.extraction_mode != 'stream':
+            print(f"ℹ️  Extraction mode '{self.extraction_mode}' needs a cluster; using 'stream' offline")
+            self.extraction_mode = 'stream'
+        self.composite_page_size = int(os.getenv('LTR_COMPOSITE_PAGE_SIZE', 1000))
+
+        # Incremental extraction: persisted high-watermark + materialized sessions under LTR_MODEL_DIR
+        self.incremental = os.getenv('LTR_INCREMENTAL', 'true').lower() == 'true' and not offline
+        self.initial_window = os.getenv('LTR_EXTRACT_INITIAL_WINDOW', 'now-1h')
+        # Materialized sessions older than this are pruned before the state is persisted
+        self.training_window = os.getenv('LTR_TRAINING_WINDOW', self.initial_window)
+        self.watermark_path = os.path.join(self.models_dir, 'extraction_watermark.json')
+        self.materialized_path = os.path.join(self.models_dir, 'materialized_sessions.pkl')
+        if full_refresh:
+            print("🔄 Full refresh requested: ignoring persisted watermark and sessions")
+            for path in (self.watermark_path, self.materialized_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        self._load_incremental_state()
+
+        # Day-partitioned Parquet spool of extracted events (stream extraction mode)
+        self.event_spool = None
+        if os.getenv('LTR_EVENT_SPOOL', 'true').lower() == 'true' and not offline:
+            if pq is None:
+                print("⚠️  pyarrow not installed; event spool disabled")
+            else:
+                self.event_spool = EventSpool(
+                    os.path.join(self.models_dir, 'event_spool'),
+                    rows_per_file=int(os.getenv('LTR_SPOOL_ROWS_PER_FILE', 100000))
+                )
+        self.spool_seal_delay = timedelta(minutes=int(os.getenv('LTR_SPOOL_SEAL_DELAY_MINUTES', 60)))
     
     def has_enough_interactions(self, min_interactions: int = int(os.getenv('LTR_MIN_INTERACTIONS', 100))) -> bool:
         """Check if there are enough property_engagement events in the data stream (aligned with new schema)"""
         try:
+            if self.data_source:
+                count = self.data_source.count_events("property_engagement")
+                print(f"🔎 Found {count} property_engagement events in {self.data_source.name} data source")
+                return count >= min_interactions
             query = {
                 "query": {
                     "term": {
@@ -161,7 +1647,8 @@ class UnifiedDataStreamLTRTrainer:
                     }
                 }
             }
-            result = self.es_client.count(index=self.data_stream, body=query)
+            result = self.es_client.count(index=self.data_stream, body=query, filter_path='count')
+            self._record_payload('events.count', result)
             count = result.get('count', 0)
             print(f"🔎 Found {count} property_engagement events in '{self.data_stream}'")
             return count >= min_interactions
@@ -171,6 +1658,8 @@ class UnifiedDataStreamLTRTrainer:
         
     def check_connection(self):
         """Verify Elasticsearch connection and data stream access"""
+        if self.data_source:
+            return self.data_source.check()
         try:
             info = self.es_client.info()
             print(f"✅ Connected to Elasticsearch {info['version']['number']}")
@@ -192,22 +1681,28 @@ class UnifiedDataStreamLTRTrainer:
         """Fetch property data and calculate enhanced relevance features"""
         try:
             # Check if document ID exists before attempting to fetch
-            exists = self.es_client.exists(
-                index='properties',
-                id=document_id
-            )
-            
-            if not exists:
+            if not self._is_known_property(document_id):
                 raise ValueError(f"Document ID {document_id} does not exist in properties index")
                 
-            # Get property document by ID from the embeddings index
-            doc_response = self.es_client.get(
-                index='properties',
-                id=document_id
-            )
-            property_data = doc_response['_source']
-            # Add the document ID to property_data
-            property_data['_id'] = doc_response['_id']
+            cached = self.property_cache.get(document_id)
+            if cached is not None:
+                property_data = dict(cached)
+                property_data['_id'] = document_id
+            elif self.data_source:
+                property_data = dict(self.data_source.get_property(document_id))
+                property_data['_id'] = document_id
+            else:
+                # Get property document by ID from the embeddings index
+                doc_response = self.es_client.get(
+                    index='properties',
+                    id=document_id,
+                    source_includes=PROPERTY_SOURCE_FIELDS,
+                    filter_path=PROPERTY_GET_FILTER_PATH
+                )
+                self._record_payload('properties.get', doc_response)
+                property_data = doc_response['_source']
+                # Add the document ID to property_data
+                property_data['_id'] = doc_response['_id']
             
             # Initialize feature dict
             features = {}
@@ -246,12 +1741,7 @@ class UnifiedDataStreamLTRTrainer:
                 'query': {
                     'multi_match': {
                         'query': query,
-                        'fields': [
-                            'title^2',
-                            'property-description^1.5', 
-                            'property-features^1.2',
-                            'headings^1.1'
-                        ]
+                        'fields': [f"{field}^{boost:g}" for field, boost, _ in BM25_FIELDS]
                     }
                 }
             }
@@ -259,33 +1749,141 @@ class UnifiedDataStreamLTRTrainer:
             explain_response = self.es_client.explain(
                 index='properties',
                 id=doc_id,
-                body=explain_query
+                body=explain_query,
+                filter_path=EXPLAIN_FILTER_PATH
             )
+            self._record_payload('properties.explain', explain_response)
             
             return self.parse_explain_scores(explain_response)
             
         except Exception as e:
             print(f"⚠️  BM25 extraction failed for {doc_id}: {e}")
-            return {
-                'bm25_title_score': 0.0,
-                'bm25_description_score': 0.0,
-                'bm25_features_score': 0.0,
-                'bm25_headings_score': 0.0,
-                'bm25_combined_score': 0.0
+            return self._default_bm25_scores()
+
+    def _default_bm25_scores(self) -> Dict[str, float]:
+        scores = {feature: 0.0 for _, _, feature in BM25_FIELDS}
+        scores['bm25_combined_score'] = 0.0
+        return scores
+
+    def get_bm25_scores_batch(self, query: str, doc_ids: List[str]) -> Dict[str, Dict[str, float]]:
+        """Per-field BM25 scores for many documents with one search using named match clauses"""
+        if self.local_bm25 is not None:
+            return dict(self._parse_bm25_hits(doc_ids, []), **self.local_bm25.score(query, doc_ids))
+        if not doc_ids or not query:
+            return self._parse_bm25_hits(doc_ids, [])
+        try:
+            response = self.es_client.search(
+                index='properties',
+                body=self._bm25_batch_body(query, doc_ids),
+                include_named_queries_score=True,
+                filter_path=NAMED_SCORES_FILTER_PATH
+            )
+            self._record_payload('properties.bm25_batch', response)
+            return self._parse_bm25_hits(doc_ids, response.get('hits', {}).get('hits', []))
+        except Exception as e:
+            print(f"⚠️  Batched BM25 extraction failed for {len(doc_ids)} documents: {e}")
+            return self._parse_bm25_hits(doc_ids, [])
+
+    def _bm25_batch_body(self, query: str, doc_ids: List[str]) -> dict:
+        return {
+            'query': {
+                'bool': {
+                    'filter': [{'ids': {'values': list(doc_ids)}}],
+                    'should': [
+                        {'match': {field: {'query': query, 'boost': boost, '_name': feature}}}
+                        for field, boost, feature in BM25_FIELDS
+                    ]
+                }
+            },
+            'size': len(doc_ids),
+            '_source': False,
+            'track_total_hits': False
+        }
+
+    def _parse_bm25_hits(self, doc_ids: List[str], hits: list) -> Dict[str, Dict[str, float]]:
+        scores = {doc_id: self._default_bm25_scores() for doc_id in doc_ids}
+        for hit in hits:
+            named = hit.get('matched_queries') or {}
+            if not isinstance(named, dict):
+                continue
+            doc_scores = scores.setdefault(hit['_id'], self._default_bm25_scores())
+            for _, _, feature in BM25_FIELDS:
+                doc_scores[feature] = float(named.get(feature, 0.0))
+            # multi_match best_fields scores a document by its best field
+            doc_scores['bm25_combined_score'] = max(doc_scores[feature] for _, _, feature in BM25_FIELDS)
+        return scores
+
+    def compute_feature_families(self, query: str, doc_ids: List[str], families: List[str],
+                                 cluster_scores: Optional[Dict[str, Dict[str, Dict[str, float]]]] = None) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """Requested feature families per document (doc_id -> family -> features); unknown documents get none"""
+        local_bm25 = self.local_bm25.score(query, doc_ids) if self.local_bm25 is not None and 'bm25' in families else None
+        local_semantic = (self.local_semantic_similarity(query, doc_ids)
+                          if self.local_semantic is not None and 'semantic' in families else None)
+        if cluster_scores is None and self.es_client is not None and any(f in self._cluster_families() for f in families):
+            bm25_scores = self.get_bm25_scores_batch(query, doc_ids)
+            semantic_scores = self.calculate_semantic_similarity_batch(query, doc_ids)
+            cluster_scores = {
+                doc_id: {'bm25': bm25_scores[doc_id], 'semantic': semantic_scores[doc_id]}
+                for doc_id in doc_ids
             }
+        batch_attributes = {}
+        if 'attributes' in families and self.use_attribute_store:
+            # All regular store rows of the batch go through one vectorized pass
+            rows = self.attribute_rows(doc_ids)
+            regular = np.flatnonzero(rows >= 0)
+            regular = regular[~self.attribute_store.irregular[rows[regular]]]
+            store_rows = rows[regular]
+            values = self.extract_property_attributes_batch(
+                self.attribute_store.gather(store_rows),
+                self.attribute_store.is_fl[store_rows],
+                np.full(len(regular), self.extract_bedrooms_from_query(query)),
+                np.full(len(regular), self.extract_bathrooms_from_query(query))
+            )
+            for i, position in enumerate(regular):
+                batch_attributes[doc_ids[position]] = dict(zip(ATTRIBUTE_FEATURES, values[i].tolist()))
+        batch_matching = {}
+        if 'matching' in families and self.use_token_index:
+            batch_matching = self.calculate_query_document_matching_batch(query, doc_ids)
+        computed = {}
+        for doc_id in doc_ids:
+            property_data = self._get_property_data(doc_id)
+            if property_data is None:
+                continue
+            property_data = dict(property_data, _id=doc_id)
+            doc_families = {}
+            for family in families:
+                if family == 'bm25' and local_bm25 is not None:
+                    # Documents missing from the local corpus are left unscored rather than zeroed
+                    if doc_id in local_bm25:
+                        doc_families[family] = local_bm25[doc_id]
+                elif family == 'semantic' and local_semantic is not None:
+                    if doc_id in local_semantic:
+                        doc_families[family] = local_semantic[doc_id]
+                elif family in CLUSTER_FEATURE_FAMILIES:
+                    # Cluster scores are unavailable offline; leave those families uncomputed
+                    if cluster_scores is not None and family in cluster_scores.get(doc_id, {}):
+                        doc_families[family] = cluster_scores[doc_id][family]
+                elif family == 'attributes':
+                    if doc_id in batch_attributes:
+                        doc_families[family] = batch_attributes[doc_id]
+                    else:
+                        doc_families[family] = self.extract_property_attributes(property_data, query)
+                elif family == 'geo':
+                    doc_families[family] = self.calculate_geo_relevance(property_data, query)
+                elif family == 'matching':
+                    if doc_id in batch_matching:
+                        doc_families[family] = batch_matching[doc_id]
+                    else:
+                        doc_families[family] = self.calculate_query_document_matching(property_data, query)
+            computed[doc_id] = doc_families
+        return computed
     
     def parse_explain_scores(self, explain_response: dict) -> Dict[str, float]:
         """Parse Elasticsearch explain response to extract field-specific BM25 scores"""
-        scores = {
-            'bm25_title_score': 0.0,
-            'bm25_description_score': 0.0,
-            'bm25_features_score': 0.0,
-            'bm25_headings_score': 0.0,
-            'bm25_combined_score': 0.0
-        }
+        scores = self._default_bm25_scores()
         
         try:
-            if 'explanation' in explain_response and explain_response['matched']:
+            if 'explanation' in explain_response and explain_response.get('matched'):
                 total_score = explain_response['explanation']['value']
                 scores['bm25_combined_score'] = total_score
                 
@@ -312,6 +1910,9 @@ class UnifiedDataStreamLTRTrainer:
     
     def calculate_semantic_similarity(self, query: str, property_data: dict) -> Dict[str, float]:
         """Calculate semantic similarity using Elasticsearch vector search"""
+        if self.local_semantic is not None:
+            doc_id = property_data.get("id", property_data.get("_id", ""))
+            return self.calculate_semantic_similarity_batch(query, [doc_id])[doc_id]
         try:
             # Get the document ID
             doc_id = property_data.get("id", property_data.get("_id", ""))
@@ -327,7 +1928,10 @@ class UnifiedDataStreamLTRTrainer:
                                         "query": query
                                     }
                                 }
-                            },
+                            }
+                        ],
+                        # Filter context: the id restriction adds nothing to the score
+                        "filter": [
                             {
                                 "term": {
                                     "_id": doc_id
@@ -341,10 +1945,14 @@ class UnifiedDataStreamLTRTrainer:
             desc_response = self.es_client.search(
                 index="properties",
                 body=semantic_query,
-                size=1
+                size=1,
+                source=False,
+                filter_path=SCORE_FILTER_PATH
             )
+            self._record_payload('properties.semantic_search', desc_response)
             
-            desc_score = desc_response["hits"]["hits"][0]["_score"] if desc_response["hits"]["hits"] else 0.0
+            desc_hits = desc_response.get("hits", {}).get("hits", [])
+            desc_score = desc_hits[0]["_score"] if desc_hits else 0.0
             
             # Similar query for features field
             features_query = {
@@ -357,7 +1965,10 @@ class UnifiedDataStreamLTRTrainer:
                                         "query": query
                                     }
                                 }
-                            },
+                            }
+                        ],
+                        # Filter context: the id restriction adds nothing to the score
+                        "filter": [
                             {
                                 "term": {
                                     "_id": doc_id
@@ -366,31 +1977,259 @@ class UnifiedDataStreamLTRTrainer:
                         ]
                     }
                 }
-            }
-            
-            features_response = self.es_client.search(
-                index="properties",
-                body=features_query,
-                size=1
-            )
-            
-            features_score = features_response["hits"]["hits"][0]["_score"] if features_response["hits"]["hits"] else 0.0
-            
-            # Average the scores for overall semantic match
-            avg_score = (desc_score + features_score) / 2.0
-            
-            return {
+            }
+            
+            features_response = self.es_client.search(
+                index="properties",
+                body=features_query,
+                size=1,
+                source=False,
+                filter_path=SCORE_FILTER_PATH
+            )
+            self._record_payload('properties.semantic_search', features_response)
+            
+            features_hits = features_response.get("hits", {}).get("hits", [])
+            features_score = features_hits[0]["_score"] if features_hits else 0.0
+            
+            # Average the scores for overall semantic match
+            avg_score = (desc_score + features_score) / 2.0
+            
+            return {
+                "semantic_description_similarity": desc_score,
+                "semantic_features_similarity": features_score,
+                "semantic_query_embedding_match": avg_score
+            }
+        except Exception as e:
+            print(f"⚠️  Semantic similarity failed: {e}")
+            return {
+                "semantic_description_similarity": 0.0,
+                "semantic_features_similarity": 0.0,
+                "semantic_query_embedding_match": 0.0
+            }
+
+    def calculate_semantic_similarity_batch(self, query: str, doc_ids: List[str]) -> Dict[str, Dict[str, float]]:
+        """Semantic similarity for many documents with one request per semantic field (query embedded once per field)"""
+        if self.local_semantic is not None:
+            return dict(self._combine_semantic_scores(doc_ids, {}), **self.local_semantic_similarity(query, doc_ids))
+        field_scores = {}
+        for field in SEMANTIC_FIELDS:
+            field_scores[field] = {}
+            if not doc_ids or not query:
+                continue
+            try:
+                response = self.es_client.search(
+                    index='properties',
+                    body=self._semantic_batch_body(field, query, doc_ids),
+                    filter_path=SCORE_FILTER_PATH
+                )
+                self._record_payload('properties.semantic_batch', response)
+                for hit in response.get('hits', {}).get('hits', []):
+                    field_scores[field][hit['_id']] = hit['_score']
+            except Exception as e:
+                print(f"⚠️  Batched semantic similarity failed on {field}: {e}")
+        return self._combine_semantic_scores(doc_ids, field_scores)
+
+    def encode_query(self, query: str) -> np.ndarray:
+        """Normalized query embedding from the encoder the property matrix was built with (cached per query text)"""
+        # Case is kept: the E5 tokenizer is cased, and the cluster embeds the raw query
+        query = ' '.join((query or '').split())
+        vector = self.query_embedding_cache.get(query)
+        if vector is not None:
+            return vector
+        if self._query_encoder is None:
+            # Queries go through the same encoder variant the property matrix was built with
+            self._query_encoder = PropertyEmbeddingEncoder(
+                self.local_semantic.model_name, quantize=self.local_semantic.encoder_variant == 'int8'
+            )
+        vector = self._query_encoder.encode([query], kind='query')[0]
+        self.query_embedding_cache.put(query, vector)
+        return vector
+
+    def report_property_cache_stats(self):
+        """Print property cache hit rate, evictions and resident size"""
+        cache = self.property_cache
+        stats = cache.stats
+        if not (stats['hits'] or stats['spill_hits'] or stats['misses']):
+            return
+        print(f"🏠 Property cache: {cache.hit_rate():.1%} hit rate ({stats['hits']} hits, "
+              f"{stats['spill_hits']} spill hits, {stats['misses']} misses), {stats['evictions']} evictions, "
+              f"{len(cache)} entries / {cache.resident_bytes / 1024 / 1024:.1f} MiB resident "
+              f"(budget {cache.max_bytes / 1024 / 1024:.1f} MiB)")
+
+    def report_query_cache_stats(self):
+        """Persist new query embeddings and print cache hit/miss counts"""
+        if self.query_embedding_cache is None:
+            return
+        self.query_embedding_cache.flush()
+        stats = self.query_embedding_cache.stats
+        lookups = sum(stats.values())
+        if lookups:
+            hit_rate = (stats['memory_hits'] + stats['disk_hits']) / lookups
+            print(f"🧠 Query embedding cache: {stats['memory_hits']} memory hits, {stats['disk_hits']} disk hits, "
+                  f"{stats['misses']} misses ({hit_rate:.1%} hit rate)")
+
+    def close(self):
+        """Flush and close the SQLite-backed stores (feature store, query embedding cache, cache spill)"""
+        for store in (self.feature_store, self.query_embedding_cache, self.property_cache):
+            if store is not None:
+                store.close()
+        self.feature_store = None
+        self.query_embedding_cache = None
+
+    def local_semantic_similarity(self, query: str, doc_ids: List[str]) -> Dict[str, Dict[str, float]]:
+        """Semantic features from the precomputed embedding matrix for the embedded documents among doc_ids"""
+        if not query:
+            known = [doc_id for doc_id in doc_ids if doc_id in self.local_semantic.doc_index]
+            return self._combine_semantic_scores(known, {})
+        return self.local_semantic.similarities(self.encode_query(query), doc_ids)
+
+    def _load_property_documents(self, from_index: bool = False, fields: Optional[List[str]] = None) -> List[Tuple[str, dict]]:
+        fields = fields or list(PropertyEmbeddingMatrix.FIELDS)
+        if from_index:
+            return [
+                (hit['_id'], hit.get('_source', {}))
+                for hit in helpers.scan(self.es_client, index='properties', size=1000,
+                                        query={'_source': fields, 'query': {'match_all': {}}})
+            ]
+        documents = []
+        with open(self.properties_file, 'r') as f:
+            for line_no, line in enumerate(f):
+                line = line.strip()
+                if line:
+                    doc = json.loads(line)
+                    # Keyed like FileDataSource so offline events resolve to the same rows
+                    doc_id = FileDataSource.property_id(doc, line_no, self.properties_id_field)
+                    if doc_id is not None:
+                        documents.append((doc_id, doc))
+        return documents
+
+    def build_property_embeddings(self, chunk_size: int = 1024) -> bool:
+        """Encode property descriptions and features into the local embedding matrix
+
+        Online the properties come from an index scan, so rows carry the ids events refer to; offline they
+        are read from the properties file and keyed like FileDataSource.
+        """
+        try:
+            start = time.perf_counter()
+            from_index = self.data_source is None
+            documents = self._load_property_documents(from_index)
+            source = 'properties index' if from_index else self.properties_file
+            encoder = PropertyEmbeddingEncoder(
+                self.embedding_model, quantize=self.embedding_quantize, token_budget=self.embedding_token_budget
+            )
+            print(f"🧭 Encoding {len(documents)} properties from {source} with {self.embedding_model} "
+                  f"({encoder.variant} encoder, {self.embedding_storage} storage)...")
+            matrix = PropertyEmbeddingMatrix.build(
+                self.embeddings_dir, encoder, documents, chunk_size=chunk_size, storage=self.embedding_storage
+            )
+            print(f"✅ Property embeddings ({len(matrix.doc_ids)} x {encoder.dim}) written to {self.embeddings_dir} "
+                  f"in {time.perf_counter() - start:.1f}s")
+            return True
+        except Exception as e:
+            print(f"❌ Building property embeddings failed: {e}")
+            return False
+
+    def benchmark_embedding_encoders(self, limit: int = 2000, field: str = 'property-description') -> bool:
+        """Compare fp32 and int8-quantized encoders on property texts: throughput and cosine agreement"""
+        try:
+            texts = [str(source.get(field) or '').strip() for _, source in self._load_property_documents()]
+            texts = [text for text in texts if text][:limit]
+            print(f"⏱️  Benchmarking encoders on {len(texts)} {field} texts from {self.properties_file}")
+            results = {}
+            for quantize in (False, True):
+                encoder = PropertyEmbeddingEncoder(
+                    self.embedding_model, quantize=quantize, token_budget=self.embedding_token_budget
+                )
+                start = time.perf_counter()
+                embeddings = encoder.encode(texts)
+                elapsed = time.perf_counter() - start
+                results[encoder.variant] = embeddings
+                print(f"   {encoder.variant}: {len(texts) / elapsed:.1f} texts/s ({elapsed:.1f}s)")
+
+            fp32, int8 = results['fp32'], results['int8']
+            encoder_agreement = np.sum(fp32 * int8, axis=1)
+            codes, scales = PropertyEmbeddingMatrix.quantize_rows(int8)
+            storage_agreement = np.sum(int8 * (codes.astype(np.float32) * scales[:, None]), axis=1)
+            print(f"   cosine(fp32, int8 encoder): mean {encoder_agreement.mean():.4f}, min {encoder_agreement.min():.4f}")
+            print(f"   cosine(float32, int8 storage): mean {storage_agreement.mean():.4f}, min {storage_agreement.min():.4f}")
+            return True
+        except Exception as e:
+            print(f"❌ Encoder benchmark failed: {e}")
+            return False
+
+    def _ensure_attribute_store(self) -> PropertyAttributeStore:
+        """Build the columnar attribute store once from the properties file (offline) or an index scan"""
+        if self.attribute_store is None:
+            start = time.perf_counter()
+            from_index = self.data_source is None
+            try:
+                documents = self._load_property_documents(from_index, fields=PropertyAttributeStore.SOURCE_FIELDS)
+            except Exception as e:
+                # Documents are then added as they are fetched
+                print(f"⚠️  Could not load property attributes up front: {e}")
+                documents = []
+            self.attribute_store = PropertyAttributeStore.from_documents(documents)
+            source = 'properties index' if from_index else self.properties_file
+            print(f"🗃️  Attribute store: {self.attribute_store.size} properties from {source} "
+                  f"({self.attribute_store.nbytes() / 1024:.0f} KiB) in {time.perf_counter() - start:.2f}s")
+        return self.attribute_store
+
+    def _ensure_local_bm25(self) -> Optional[LocalBM25Index]:
+        """Build the local BM25 index once (LTR_BM25_ENGINE=local) from LTR_BM25_CORPUS, the properties file or an index scan"""
+        if self.bm25_engine != 'local' or self.local_bm25 is not None:
+            return self.local_bm25
+        # Online, the corpus comes from the properties index so documents carry the ids events refer to
+        corpus = os.getenv('LTR_BM25_CORPUS') or (self.properties_file if self.data_source is not None else None)
+        start = time.perf_counter()
+        try:
+            if corpus:
+                self.local_bm25 = LocalBM25Index.from_jsonl(corpus, id_field=self.properties_id_field)
+            else:
+                corpus = 'properties index'
+                self.local_bm25 = LocalBM25Index.from_documents(
+                    self._load_property_documents(from_index=True, fields=[field for field, _, _ in BM25_FIELDS])
+                )
+        except Exception as e:
+            raise ValueError(f"Could not build the local BM25 index from {corpus or 'properties index'}: {e}") from e
+        print(f"📚 Local BM25 index: {len(self.local_bm25.doc_ids)} documents from {corpus} "
+              f"in {time.perf_counter() - start:.2f}s")
+        return self.local_bm25
+
+    def attribute_rows(self, doc_ids: List[str]) -> np.ndarray:
+        """Attribute store rows for doc_ids, adding documents the store has not seen yet (-1 if unavailable)"""
+        store = self._ensure_attribute_store()
+        rows = store.rows(doc_ids)
+        for i in np.flatnonzero(rows < 0):
+            property_data = self._get_property_data(doc_ids[i])
+            if property_data is not None:
+                rows[i] = store.add(doc_ids[i], property_data)
+        return rows
+
+    def _semantic_batch_body(self, field: str, query: str, doc_ids: List[str]) -> dict:
+        # ids is a filter (like the per-document term on _id) so only the vector match is scored
+        return {
+            'query': {
+                'bool': {
+                    'must': [{'match': {field: {'query': query}}}],
+                    'filter': [{'ids': {'values': list(doc_ids)}}]
+                }
+            },
+            'size': len(doc_ids),
+            '_source': False,
+            'track_total_hits': False
+        }
+
+    def _combine_semantic_scores(self, doc_ids: List[str], field_scores: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+        similarities = {}
+        for doc_id in doc_ids:
+            desc_score = field_scores.get('property-description_semantic', {}).get(doc_id, 0.0)
+            features_score = field_scores.get('property-features_semantic', {}).get(doc_id, 0.0)
+            similarities[doc_id] = {
                 "semantic_description_similarity": desc_score,
                 "semantic_features_similarity": features_score,
-                "semantic_query_embedding_match": avg_score
-            }
-        except Exception as e:
-            print(f"⚠️  Semantic similarity failed: {e}")
-            return {
-                "semantic_description_similarity": 0.0,
-                "semantic_features_similarity": 0.0,
-                "semantic_query_embedding_match": 0.0
+                "semantic_query_embedding_match": (desc_score + features_score) / 2.0
             }
+        return similarities
 
     def extract_property_attributes(self, property_data: dict, query: str) -> Dict[str, float]:
         """Extract and normalize property attribute features"""
@@ -490,6 +2329,41 @@ class UnifiedDataStreamLTRTrainer:
                 'maintenance_fee_normalized': 0.5
             }
     
+    def extract_property_attributes_batch(self, attributes: Dict[str, np.ndarray], is_fl: np.ndarray,
+                                          query_bedrooms: np.ndarray, query_bathrooms: np.ndarray) -> np.ndarray:
+        """Vectorized extract_property_attributes: one row per (document, query) pair, ATTRIBUTE_FEATURES columns
+
+        attributes holds PropertyAttributeStore columns (NaN = missing); results match the scalar path exactly.
+        """
+        def column(name, default):
+            return np.where(np.isnan(attributes[name]), default, attributes[name])
+
+        home_price = column('home-price', 0)
+        bedrooms = attributes['number-of-bedrooms']
+        bathrooms = column('number-of-bathrooms', 0)
+        features = np.empty((len(home_price), len(ATTRIBUTE_FEATURES)), dtype=np.float64)
+
+        features[:, 0] = np.minimum(home_price / 500000, 2.0)
+        for col, prop_count, query_count in ((1, np.where(np.isnan(bedrooms), 0, bedrooms), query_bedrooms),
+                                             (2, bathrooms, query_bathrooms)):
+            match = np.where(prop_count == query_count, 1.0, np.maximum(0, 1 - np.abs(prop_count - query_count) * 0.2))
+            features[:, col] = np.where(query_count > 0, match, 0.5)
+        features[:, 3] = np.minimum(column('square-footage', 0) / 1500, 3.0)
+        features[:, 4] = np.minimum(column('annual-tax', 0) / 10000, 2.0)
+        features[:, 5] = np.minimum(column('maintenance-fee', 0) / 500, 2.0)
+
+        # Same thresholds (and float rounding) as the scalar ladders; right=True keeps their "<=" edges
+        price_per_sqft = home_price / np.maximum(1, column('square-footage', 1000))
+        threshold_sqft_price = 200
+        value_bins = [threshold_sqft_price * 0.7, threshold_sqft_price * 0.85, threshold_sqft_price,
+                      threshold_sqft_price * 1.15]
+        value_scores = np.array([1.0, 0.8, 0.6, 0.3, 0.1])
+        features[:, 6] = np.where(is_fl & (bedrooms == 3),
+                                  value_scores[np.digitize(price_per_sqft, value_bins, right=True)], 0.5)
+        tier_scores = np.array([1.0, 0.8, 0.5, 0.3, 0.1])
+        features[:, 7] = tier_scores[np.digitize(home_price, [275000, 350000, 400000, 500000], right=True)]
+        return features
+
     def calculate_geo_relevance(self, property_data: dict, query: str) -> Dict[str, float]:
         """Calculate geo-relevance features"""
         try:
@@ -497,7 +2371,7 @@ class UnifiedDataStreamLTRTrainer:
             # In production, you'd extract location from query and calculate actual distances
             
             has_location = bool(property_data.get('location') or property_data.get('geo_point'))
-            query_has_location = bool(any(word in query.lower() for word in ['near', 'downtown', 'city', 'neighborhood', 'area']))
+            query_has_location = self.query_analyzer.analyze(query).has_location_intent
             
             return {
                 'geo_distance_km': 5.0 if has_location else 10.0,  # Default reasonable distance
@@ -554,15 +2428,69 @@ class UnifiedDataStreamLTRTrainer:
                 'property_status_relevance': 0.7
             }
     
+    def token_rows(self, doc_ids: List[str]) -> np.ndarray:
+        """Token index rows for doc_ids, indexing documents not seen yet (-1 if unavailable)"""
+        rows = np.array([self.token_index.doc_index.get(doc_id, -1) for doc_id in doc_ids], dtype=np.int64)
+        for i in np.flatnonzero(rows < 0):
+            property_data = self._get_property_data(doc_ids[i])
+            if property_data is not None:
+                rows[i] = self.token_index.add(doc_ids[i], property_data)
+        return rows
+
+    def match_titles(self, queries, doc_ids):
+        """Find every (query, title) exact substring hit with one Aho-Corasick pass over each title
+
+        Replaces the previous results, so every recorded title has been scanned for every recorded query.
+        """
+        start = time.perf_counter()
+        patterns = sorted({query.lower() for query in queries})
+        matcher = AhoCorasickMatcher(patterns)
+        title_matches = {}
+        hits = 0
+        for doc_id in set(doc_ids):
+            property_data = self._get_property_data(doc_id)
+            title = property_data.get('title', '') if property_data is not None else None
+            if not isinstance(title, str):
+                continue
+            title_matches[doc_id] = {patterns[pid] for pid in matcher.scan(title.lower())}
+            hits += len(title_matches[doc_id])
+        scanned = len(title_matches)
+        self.title_matches = title_matches
+        self.title_match_patterns = set(patterns)
+        print(f"🔤 Title matcher: {len(patterns)} queries over {scanned} titles, {hits} exact-match hits "
+              f"in {time.perf_counter() - start:.2f}s")
+
+    def _title_exact_match(self, query_lower: str, doc_id: str) -> float:
+        if query_lower in self.title_match_patterns and doc_id in self.title_matches:
+            return 1.0 if query_lower in self.title_matches[doc_id] else 0.0
+        return 1.0 if query_lower in self._get_property_data(doc_id).get('title', '').lower() else 0.0
+
+    def calculate_query_document_matching_batch(self, query: str, doc_ids: List[str]) -> Dict[str, Dict[str, float]]:
+        """calculate_query_document_matching for the regular indexed documents among doc_ids"""
+        rows = self.token_rows(doc_ids)
+        regular = [i for i in np.flatnonzero(rows >= 0) if not self.token_index.irregular[rows[i]]]
+        if not regular:
+            return {}
+        overlap = self.token_index.query_overlap(self.query_analyzer.analyze(query), rows[regular])
+        query_lower = query.lower()
+        matching = {}
+        for i, position in enumerate(regular):
+            doc_id = doc_ids[position]
+            matching[doc_id] = {
+                'title_query_exact_match': self._title_exact_match(query_lower, doc_id),
+                'description_query_coverage': float(overlap['property-description'][i]),
+                'features_query_overlap': float(overlap['property-features'][i]),
+                'property_status_relevance': self.token_index.status_relevance[rows[position]]
+            }
+        return matching
+
     def extract_bedrooms_from_query(self, query: str) -> int:
         """Extract bedroom count from query"""
-        match = re.search(r'(\d+)[\s-]*(?:bed|bedroom)', query.lower())
-        return int(match.group(1)) if match else 0
+        return self.query_analyzer.analyze(query).bedrooms
     
     def extract_bathrooms_from_query(self, query: str) -> int:
         """Extract bathroom count from query"""
-        match = re.search(r'(\d+)[\s-]*(?:bath|bathroom)', query.lower())
-        return int(match.group(1)) if match else 0
+        return self.query_analyzer.analyze(query).bathrooms
     
     def get_default_property_features(self) -> Dict[str, float]:
         """Return default values for all property-based features"""
@@ -595,28 +2523,32 @@ class UnifiedDataStreamLTRTrainer:
     def extract_search_results(self):
         """Extract search_result_logged events to get both document IDs and query metadata (aligned with new schema)"""
         print("📊 Extracting search result events from unified data stream...")
-        results_query = self._build_events_query("search_result_logged", 10000)
         try:
-            response = self.es_client.search(
-                index=self.data_stream,
-                body=results_query
-            )
             # Create two lookups:
             # 1. session_id -> position -> document_id
             # 2. session_id -> metadata (query, template_id, search_time, etc.)
-            results_lookup, query_metadata = self._process_search_results(response)
+            if self.extraction_mode == 'composite':
+                results_lookup, query_metadata = self._extract_search_results_composite()
+            else:
+                results_lookup, query_metadata = self._process_search_results(
+                    self._extract_hits("search_result_logged")
+                )
+            if self.incremental:
+                print(f"📈 Delta: {len(results_lookup)} sessions since last watermark")
+                results_lookup, query_metadata = self._merge_materialized_sessions(results_lookup, query_metadata)
             print(f"✅ Found {len(results_lookup)} sessions with search results")
             print(f"✅ Extracted query metadata for {len(query_metadata)} sessions")
             return results_lookup, query_metadata
         except Exception as e:
             print(f"❌ Failed to extract search results: {e}")
+            self._discard_pending_watermark("search_result_logged")
             return {}, {}
-    
-    def _process_search_results(self, response):
-        """Process search results to build lookup dictionaries for both document IDs and query metadata (aligned with new schema)"""
+
+    def _process_search_results(self, hits):
+        """Process search result hits to build lookup dictionaries for both document IDs and query metadata (aligned with new schema)"""
         results_lookup = {}
         query_metadata = {}
-        for hit in response['hits']['hits']:
+        for hit in hits:
             source = hit['_source']
             # Use nested access for custom.* fields (new schema)
             custom = source.get('custom', {})
@@ -624,42 +2556,213 @@ class UnifiedDataStreamLTRTrainer:
             result = custom.get('result', {})
             position = result.get('position')
             doc_id = result.get('document_id')
-            # Extract document ID mapping
+            # Extract document ID mapping (existence is resolved in one batch below)
             if session_id and position and doc_id:
                 if session_id not in results_lookup:
                     results_lookup[session_id] = {}
-                if self._validate_document_id(doc_id):
-                    results_lookup[session_id][position] = doc_id
+                results_lookup[session_id][position] = doc_id
             # Extract query metadata (only once per session)
             if session_id and session_id not in query_metadata:
-                query = custom.get('query', {}).get('text', '')
-                results_count = custom.get('query', {}).get('result_count', 0)
-                template_id = custom.get('query', {}).get('template_id', '')
-                search_time = custom.get('performance', {}).get('search_time_ms', 100)
-                filters = custom.get('query', {}).get('filters', {})
-                has_geo_filter = bool(filters.get('geo'))
-                has_price_filter = filters.get('home_price') is not None
-                has_bedroom_filter = filters.get('bedrooms') is not None
-                query_metadata[session_id] = {
-                    'query': query,
-                    'results_count': results_count,
-                    'search_time': search_time,
-                    'template_id': template_id,
-                    'timestamp': source.get('@timestamp'),
-                    'has_geo_filter': has_geo_filter,
-                    'has_price_filter': has_price_filter,
-                    'has_bedroom_filter': has_bedroom_filter,
-                    'search_event': source  # Store the full event for additional metadata
+                query_metadata[session_id] = self._build_query_metadata(source)
+        self._drop_missing_documents(results_lookup)
+        return results_lookup, query_metadata
+
+    def _build_query_metadata(self, source):
+        """Build the per-session query metadata record from a search_result_logged event source"""
+        custom = source.get('custom', {})
+        query = custom.get('query', {}).get('text', '')
+        results_count = custom.get('query', {}).get('result_count', 0)
+        template_id = custom.get('query', {}).get('template_id', '')
+        search_time = custom.get('performance', {}).get('search_time_ms', 100)
+        filters = custom.get('query', {}).get('filters', {})
+        has_geo_filter = bool(filters.get('geo'))
+        has_price_filter = filters.get('home_price') is not None
+        has_bedroom_filter = filters.get('bedrooms') is not None
+        return {
+            'query': query,
+            'results_count': results_count,
+            'search_time': search_time,
+            'template_id': template_id,
+            'timestamp': source.get('@timestamp'),
+            'has_geo_filter': has_geo_filter,
+            'has_price_filter': has_price_filter,
+            'has_bedroom_filter': has_bedroom_filter,
+            'search_event': source  # Store the full event for additional metadata
+        }
+
+    def _build_session_composite_query(self, after_key=None, upper_bound=None):
+        """Build a composite aggregation over sessions with position -> document sub-buckets and one metadata hit"""
+        query = self._build_events_query("search_result_logged")
+        if upper_bound:
+            # Nothing newer than the bound the watermark will be set to
+            query["query"]["bool"]["filter"][1]["range"]["@timestamp"]["lte"] = upper_bound
+        composite = {
+            "size": self.composite_page_size,
+            "sources": [{"session": {"terms": {"field": "custom.session.id"}}}]
+        }
+        if after_key:
+            composite["after"] = after_key
+        return {
+            "query": query["query"],
+            "size": 0,
+            "track_total_hits": False,
+            "aggs": {
+                "sessions": {
+                    "composite": composite,
+                    "aggs": {
+                        # Only the top 10 positions are used for training
+                        "positions": {
+                            "terms": {"field": "custom.result.position", "size": 10, "order": {"_key": "asc"}},
+                            "aggs": {
+                                "documents": {"terms": {"field": "custom.result.document_id", "size": 1}}
+                            }
+                        },
+                        "metadata": {
+                            "top_hits": {
+                                "size": 1,
+                                "sort": [{"@timestamp": {"order": "asc"}}],
+                                "_source": {"includes": ["@timestamp", "custom.query", "custom.performance"]}
+                            }
+                        }
+                    }
                 }
+            }
+        }
+
+    def _extract_search_results_composite(self):
+        """Build results_lookup and query_metadata server-side by paging a composite aggregation over sessions"""
+        results_lookup = {}
+        query_metadata = {}
+        after_key = None
+        pages = 0
+        total_bytes = 0
+        # One point-in-time for the bound, the pages and the boundary ids so no event falls between them
+        pit = {'id': self._open_events_pit()}
+        try:
+            upper_bound = self._latest_event_timestamp("search_result_logged", pit) if self.incremental else None
+            while True:
+                body = dict(self._build_session_composite_query(after_key, upper_bound),
+                            pit={"id": pit['id'], "keep_alive": self.pit_keep_alive})
+                response = self.es_client.search(
+                    body=body,
+                    filter_path='pit_id,aggregations.sessions.after_key,aggregations.sessions.buckets'
+                )
+                pit['id'] = response.get('pit_id', pit['id'])
+                pages += 1
+                total_bytes += self._record_payload('events.composite', response)
+                if not self._collect_session_buckets(response, results_lookup, query_metadata):
+                    break
+                after_key = response['aggregations']['sessions'].get('after_key')
+                if not after_key:
+                    break
+            if upper_bound:
+                self._observe_boundary_events("search_result_logged", upper_bound, pit)
+        finally:
+            self._close_events_pit(pit['id'], "search_result_logged")
+        print(f"✅ Composite extraction: {len(results_lookup)} sessions in {pages} pages ({total_bytes / 1024:.1f} KiB)")
+        self._drop_missing_documents(results_lookup)
         return results_lookup, query_metadata
+
+    def _collect_session_buckets(self, response, results_lookup, query_metadata):
+        """Add one composite page of session buckets to the lookups; False when the page is empty"""
+        sessions = response.get('aggregations', {}).get('sessions', {})
+        buckets = sessions.get('buckets', [])
+        for bucket in buckets:
+            session_id = bucket['key']['session']
+            positions = results_lookup.setdefault(session_id, {})
+            for position_bucket in bucket['positions']['buckets']:
+                doc_buckets = position_bucket['documents']['buckets']
+                if not doc_buckets:
+                    continue
+                positions[int(position_bucket['key'])] = doc_buckets[0]['key']
+            metadata_hits = bucket['metadata']['hits']['hits']
+            if metadata_hits:
+                query_metadata[session_id] = self._build_query_metadata(metadata_hits[0]['_source'])
+        return bool(buckets)
+
+    def _latest_event_timestamp(self, action_type, pit):
+        """Newest @timestamp of the delta in the point-in-time, taken before aggregation paging starts"""
+        query = self._build_events_query(action_type)["query"]
+        response = self.es_client.search(
+            body={"query": query, "size": 0, "track_total_hits": False,
+                  "aggs": {"latest": {"max": {"field": "@timestamp"}}},
+                  "pit": {"id": pit['id'], "keep_alive": self.pit_keep_alive}},
+            filter_path='pit_id,aggregations.latest.value_as_string'
+        )
+        pit['id'] = response.get('pit_id', pit['id'])
+        self._record_payload('events.watermark', response)
+        return response.get('aggregations', {}).get('latest', {}).get('value_as_string')
+
+    def _observe_boundary_events(self, action_type, upper_bound, pit):
+        """Set the watermark to the aggregated upper bound, paging every event id that shares it"""
+        query = self._build_events_query(action_type, time_range={"gte": upper_bound, "lte": upper_bound})
+        query["_source"] = ["@timestamp"]
+        stats = {'slice': 0, 'hits': 0, 'bytes': 0, 'start': time.perf_counter()}
+        pending = self._start_pending_watermark(action_type)
+        for hits in self._page_events(query, pit, stats):
+            for hit in hits:
+                self._observe_watermark(pending, hit)
+        self._pending_watermarks[action_type] = pending
     
+    def resolve_property_membership(self, doc_ids):
+        """Resolve which document ids exist in the properties index with batched ids queries"""
+        unresolved = [doc_id for doc_id in set(doc_ids) if doc_id not in self.resolved_property_ids]
+        if not unresolved:
+            return
+        if self.data_source:
+            self.existing_property_ids.update(d for d in unresolved if self.data_source.property_exists(d))
+            self.resolved_property_ids.update(unresolved)
+            return
+        for i in range(0, len(unresolved), self.membership_batch_size):
+            batch = unresolved[i:i + self.membership_batch_size]
+            response = self.es_client.search(
+                index='properties',
+                query={'ids': {'values': batch}},
+                size=len(batch),
+                source=False,
+                track_total_hits=False,
+                filter_path='hits.hits._id'
+            )
+            self._record_payload('properties.membership', response)
+            self.existing_property_ids.update(hit['_id'] for hit in response.get('hits', {}).get('hits', []))
+            self.resolved_property_ids.update(batch)
+        print(f"✅ Resolved membership of {len(unresolved)} document ids "
+              f"({len(self.existing_property_ids)} known to exist)")
+
+    def _drop_missing_documents(self, results_lookup):
+        """Remove result positions whose document no longer exists in the properties index"""
+        doc_ids = [doc_id for session_results in results_lookup.values() for doc_id in session_results.values()]
+        try:
+            self.resolve_property_membership(doc_ids)
+        except Exception as e:
+            print(f"⚠️  Batched membership check failed, falling back to per-document exists checks: {e}")
+            # Errors here propagate: an unverifiable result set must not be emptied silently
+            self._resolve_membership_individually(doc_ids)
+        for session_results in results_lookup.values():
+            for position, doc_id in list(session_results.items()):
+                if not self._validate_document_id(doc_id):
+                    del session_results[position]
+
+    def _resolve_membership_individually(self, doc_ids):
+        """Resolve membership with one exists call per unresolved document id"""
+        unresolved = [doc_id for doc_id in set(doc_ids) if doc_id not in self.resolved_property_ids]
+        for doc_id in unresolved:
+            if self.es_client.exists(index='properties', id=doc_id):
+                self.existing_property_ids.add(doc_id)
+            self.resolved_property_ids.add(doc_id)
+        print(f"✅ Resolved membership of {len(unresolved)} document ids with exists checks "
+              f"({len(self.existing_property_ids)} known to exist)")
+
+    def _is_known_property(self, doc_id):
+        """Membership lookup; unresolved ids are checked individually and remembered"""
+        if doc_id not in self.resolved_property_ids:
+            self.resolve_property_membership([doc_id])
+        return doc_id in self.existing_property_ids
+
     def _validate_document_id(self, doc_id):
-        """Validate that a document ID exists in the properties index, with caching to avoid repeated ES calls"""
+        """Validate that a document ID exists in the properties index, using the resolved membership set"""
         try:
-            if doc_id in self.property_exists_cache:
-                return self.property_exists_cache[doc_id]
-            exists = self.es_client.exists(index='properties', id=doc_id)
-            self.property_exists_cache[doc_id] = exists
+            exists = self._is_known_property(doc_id)
             if not exists:
                 print(f"⚠️  Document ID {doc_id} from search results not found in properties index, skipping")
                 return False
@@ -671,48 +2774,439 @@ class UnifiedDataStreamLTRTrainer:
     def extract_interaction_events(self):
         """Extract property_engagement events from unified data stream (aligned with new schema)"""
         print("📊 Extracting interaction events from unified data stream...")
-        # Always use size=2000 for property_engagement events
-        return self._extract_events_by_action("property_engagement", size=2000)
-    
-    def _build_events_query(self, action_type, size=1000):
-        """Build a query for extracting events by action type"""
-        # If the action_type is 'property_engagement', override size to 2000
-        if action_type == "property_engagement":
-            size = 2000
+        # Stream event sources so the interaction lookup is built with bounded memory
+        if self.incremental:
+            return self._stream_incremental_interactions()
+        return self._stream_event_sources("property_engagement")
+
+    def _stream_event_sources(self, action_type):
+        """Yield event sources for an action type, stopping quietly if extraction fails"""
+        try:
+            for hit in self._extract_hits(action_type):
+                yield hit['_source']
+        except Exception as e:
+            print(f"❌ Failed to extract {action_type} events: {e}")
+            self._discard_pending_watermark(action_type)
+
+    def _build_events_query(self, action_type, size=None, time_range=None):
+        """Build a paged query for extracting events by action type in point-in-time _shard_doc order"""
+        bool_query = {
+            "filter": [
+                {"term": {"custom.event.action": action_type}},
+                {"range": {"@timestamp": time_range or {"gte": self.initial_window}}}
+            ]
+        }
+        watermark = self.watermarks.get(action_type) if self.incremental and not time_range else None
+        if watermark:
+            # Only the delta: events at or after the watermark, minus those already processed at it
+            bool_query["filter"][1] = {"range": {"@timestamp": {"gte": watermark['timestamp']}}}
+            if watermark.get('event_ids'):
+                bool_query["must_not"] = [{"ids": {"values": watermark['event_ids']}}]
         return {
-            "query": {
-                "bool": {
-                    "filter": [
-                        {"term": {"custom.event.action": action_type}},
-                        {"range": {"@timestamp": {"gte": "now-1h"}}}
-                    ]
-                }
-            },
-            "size": size,
-            "sort": [{"@timestamp": {"order": "desc"}}]
+            "query": {"bool": bool_query},
+            "_source": {"includes": EVENT_SOURCE_FIELDS.get(action_type, [])},
+            "size": size or self.extract_page_size,
+            "sort": [{"_shard_doc": "asc"}],
+            "track_total_hits": False
         }
-    
-    def _extract_events_by_action(self, action_type, size=1000):
-        """Generic method to extract events by action type (aligned with new schema)"""
-        query = self._build_events_query(action_type, size)
+
+    def stream_events(self, action_type, page_size=None, time_range=None):
+        """Yield every hit for an action type, paging a point-in-time with search_after"""
+        if self.data_source:
+            yield from self.data_source.stream_events(action_type)
+            return
+        hits = self._raw_event_hits(action_type, page_size, time_range)
+        if not self.incremental:
+            yield from hits
+            return
+        yield from self._watermarked(action_type, hits)
+
+    def _raw_event_hits(self, action_type, page_size=None, time_range=None):
+        """PIT hits for an action type (single cursor or slices) without watermark tracking"""
+        if self.extract_slices > 1:
+            return self._stream_events_sliced(action_type, page_size, time_range)
+        return self._stream_events_single(action_type, page_size, time_range)
+
+    def _watermarked(self, action_type, hits):
+        """Pass hits through, committing the watermark they reach only once all of them have been read"""
+        # Hits arrive in _shard_doc order, so the watermark only counts once the whole stream has been read
+        pending = self._start_pending_watermark(action_type)
         try:
-            response = self.es_client.search(
-                index=self.data_stream,
-                body=query
-            )
-            events = []
-            for hit in response['hits']['hits']:
-                source = hit['_source']
-                # For new schema, just append the top-level event
-                events.append(source)
-            print(f"✅ Found {len(events)} {action_type} events")
-            if events:
-                print(f"Sample event structure: {json.dumps(events[0], indent=2)[:200]}...")
-            return events
+            for hit in hits:
+                self._observe_watermark(pending, hit)
+                yield hit
+        finally:
+            hits.close()
+        if action_type not in self._failed_extractions:
+            self._pending_watermarks[action_type] = pending
+
+    def _stream_events_single(self, action_type, page_size=None, time_range=None):
+        """Drain a single PIT cursor for an action type"""
+        query = self._build_events_query(action_type, page_size, time_range)
+        pit = {'id': self._open_events_pit()}
+        stats = {'slice': 0, 'hits': 0, 'bytes': 0, 'start': time.perf_counter()}
+        try:
+            for hits in self._page_events(query, pit, stats):
+                yield from hits
+            print(f"✅ Streamed {stats['hits']} {action_type} events")
+        finally:
+            self._close_events_pit(pit['id'], action_type)
+
+    def _open_events_pit(self):
+        """Open a point-in-time on the events data stream and return its id"""
+        return self.es_client.open_point_in_time(
+            index=self.data_stream,
+            keep_alive=self.pit_keep_alive
+        )['id']
+
+    def _close_events_pit(self, pit_id, action_type):
+        """Release a point-in-time, logging rather than raising on failure"""
+        try:
+            self.es_client.close_point_in_time(id=pit_id)
         except Exception as e:
-            print(f"❌ Failed to extract {action_type} events: {e}")
-            return []
-            
+            print(f"⚠️  Failed to close point-in-time for {action_type}: {e}")
+
+    def _page_events(self, query, pit, stats):
+        """Yield pages of hits for a (possibly sliced) PIT query, updating the pit id and throughput stats"""
+        search_after = None
+        while True:
+            body = dict(query, pit={"id": pit['id'], "keep_alive": self.pit_keep_alive})
+            if search_after is not None:
+                body["search_after"] = search_after
+            response = self.es_client.search(body=body, filter_path=EVENTS_PAGE_FILTER_PATH)
+            # The PIT id may change between pages; always continue from the latest one
+            pit['id'] = response.get('pit_id', pit['id'])
+            hits = response.get('hits', {}).get('hits', [])
+            stats['hits'] += len(hits)
+            stats['bytes'] += self._record_payload('events.search', response)
+            if not hits:
+                break
+            yield hits
+            if len(hits) < query['size']:
+                break
+            search_after = hits[-1]['sort']
+
+    def _response_bytes(self, response):
+        """Best-effort wire size of a search response (Content-Length, else serialized body size)"""
+        try:
+            length = response.meta.headers.get('content-length')
+            if length:
+                return int(length)
+        except AttributeError:
+            pass
+        body = getattr(response, 'body', response)
+        return len(json.dumps(body, separators=(',', ':')).encode('utf-8'))
+
+    def _record_payload(self, label, response):
+        """Account a response's payload size under a call label and return the byte count"""
+        size = self._response_bytes(response)
+        with self._payload_lock:
+            stats = self.payload_stats.setdefault(label, {'calls': 0, 'bytes': 0})
+            stats['calls'] += 1
+            stats['bytes'] += size
+        return size
+
+    def report_payload_stats(self):
+        """Print per-call payload sizes so projection savings can be checked"""
+        if not self.payload_stats:
+            return
+        print("📦 Elasticsearch payload per call type:")
+        for label, stats in sorted(self.payload_stats.items()):
+            avg = stats['bytes'] / max(stats['calls'], 1)
+            print(f"   {label}: {stats['calls']} calls, {stats['bytes'] / 1024:.1f} KiB total, {avg:.0f} B/call")
+
+    def _stream_events_sliced(self, action_type, page_size=None, time_range=None):
+        """Drain N PIT slices concurrently on a thread pool and yield their hits as one stream"""
+        n_slices = self.extract_slices
+        pit = {'id': self._open_events_pit()}
+        pages = queue.Queue(maxsize=n_slices * 2)
+        stop = threading.Event()
+        slice_stats = []
+
+        def drain(slice_id):
+            query = self._build_events_query(action_type, page_size, time_range)
+            query['slice'] = {'id': slice_id, 'max': n_slices}
+            stats = {'slice': slice_id, 'hits': 0, 'bytes': 0, 'start': time.perf_counter()}
+            slice_stats.append(stats)
+            slice_pit = {'id': pit['id']}
+            try:
+                for hits in self._page_events(query, slice_pit, stats):
+                    # Block while the consumer catches up, but give up if it has gone away
+                    while not stop.is_set():
+                        try:
+                            pages.put(hits, timeout=0.5)
+                            break
+                        except queue.Full:
+                            continue
+                    if stop.is_set():
+                        return
+            finally:
+                stats['seconds'] = time.perf_counter() - stats['start']
+                pit['id'] = slice_pit['id']
+
+        print(f"🧵 Exporting {action_type} events with {n_slices} PIT slices")
+        executor = ThreadPoolExecutor(max_workers=n_slices, thread_name_prefix='ltr-slice')
+        futures = [executor.submit(drain, slice_id) for slice_id in range(n_slices)]
+        try:
+            pending = set(futures)
+            while pending or not pages.empty():
+                try:
+                    yield from pages.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+                for future in [f for f in pending if f.done()]:
+                    pending.discard(future)
+                    # Surface worker failures in the consuming thread
+                    future.result()
+            self._report_slice_throughput(action_type, slice_stats)
+        finally:
+            stop.set()
+            executor.shutdown(wait=True)
+            self._close_events_pit(pit['id'], action_type)
+
+    def _report_slice_throughput(self, action_type, slice_stats):
+        """Print per-slice and total throughput for a sliced export"""
+        total_hits = 0
+        total_bytes = 0
+        for stats in sorted(slice_stats, key=lambda st: st['slice']):
+            seconds = max(stats.get('seconds', 0.0), 1e-6)
+            total_hits += stats['hits']
+            total_bytes += stats['bytes']
+            print(f"   slice {stats['slice']}: {stats['hits']} hits in {seconds:.2f}s "
+                  f"({stats['hits'] / seconds:.0f} hits/s, {stats['bytes'] / seconds / 1024:.1f} KiB/s)")
+        print(f"✅ Streamed {total_hits} {action_type} events ({total_bytes / 1024:.1f} KiB) across {len(slice_stats)} slices")
+
+    def _extract_hits(self, action_type):
+        """Yield event hits for training, going through the Parquet spool when it is enabled"""
+        if self.event_spool is None:
+            yield from self.stream_events(action_type)
+        elif self.incremental:
+            yield from self._spool_delta(action_type)
+        else:
+            yield from self._spooled_window(action_type)
+
+    def _spool_delta(self, action_type):
+        """Yield the watermark delta, reading sealed spool partitions it covers before going to Elasticsearch"""
+        watermark = self.watermarks.get(action_type)
+        if watermark:
+            start = self._parse_timestamp(watermark['timestamp'])
+            processed = set(watermark.get('event_ids', []))
+        else:
+            start, processed = self._resolve_window_start(), set()
+        yield from self._watermarked(action_type, self._spooled_events(action_type, start, processed))
+
+    def _resolve_window_start(self, window=None):
+        """Resolve LTR_EXTRACT_INITIAL_WINDOW (now-<n><s|m|h|d|w> or ISO 8601) to a UTC datetime"""
+        now = datetime.now(timezone.utc)
+        window = (window or self.initial_window).split('/')[0]  # date-math rounding is ignored
+        match = re.fullmatch(r'now-(\d+)([smhdw])', window)
+        if match:
+            unit = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}[match.group(2)]
+            return now - timedelta(**{unit: int(match.group(1))})
+        if window == 'now':
+            return now
+        return self._parse_timestamp(window)
+
+    def _spooled_window(self, action_type):
+        """Yield the extraction window from complete spool partitions, fetching only missing days"""
+        yield from self._spooled_events(action_type, self._resolve_window_start())
+
+    def _spooled_events(self, action_type, start, processed=()):
+        """Yield events at or after `start` (minus already processed ids) day by day
+
+        Complete partitions are read from the spool; past days are fetched whole once and
+        sealed; days that cannot be sealed yet are fetched from `start` on, without spooling.
+        """
+        now = datetime.now(timezone.utc)
+        columns = list(EventSpool.COLUMNS[action_type])
+        from_spool = 0
+        fetched = 0
+        day = start.date()
+        while day <= now.date():
+            day_key = day.isoformat()
+            day_start = datetime.combine(day, datetime.min.time(), timezone.utc)
+            # Past days are sealed once late-arriving events have had time to be indexed
+            sealable = day_start + timedelta(days=1) + self.spool_seal_delay <= now
+            complete = self.event_spool.is_complete(action_type, day_key)
+            if complete:
+                rows = self.event_spool.read(action_type, day_key, columns)
+                hits = (self.event_spool.unflatten(action_type, row) for row in rows)
+                from_spool += 1
+            elif sealable:
+                # Fetch the whole day so the partition can be reused by later runs
+                self.event_spool.clear_partition(action_type, day_key)
+                hits = self._fetch_spool_day(action_type, day_key)
+                fetched += 1
+            else:
+                # This and every later day are still open: fetch only the window part, up to now
+                range_start = max(start, day_start).isoformat().replace('+00:00', 'Z')
+                hits = self._raw_event_hits(action_type, time_range={"gte": range_start})
+                fetched += 1
+            for hit in hits:
+                raw_ts = hit['_source'].get('@timestamp')
+                if raw_ts and self._parse_timestamp(raw_ts) >= start and hit['_id'] not in processed:
+                    yield hit
+            if not complete and not sealable:
+                break
+            if not complete:
+                self.event_spool.mark_complete(action_type, day_key)
+            day += timedelta(days=1)
+        print(f"💾 {action_type}: {from_spool} day partitions read from spool, {fetched} fetched from Elasticsearch")
+
+    def _fetch_spool_day(self, action_type, day_key):
+        """Stream one UTC day of events from Elasticsearch into its spool partition"""
+        next_day = (datetime.fromisoformat(day_key) + timedelta(days=1)).strftime('%Y-%m-%d')
+        for hit in self._raw_event_hits(action_type, time_range={"gte": day_key, "lt": next_day}):
+            self.event_spool.append(action_type, day_key, self.event_spool.flatten(action_type, hit))
+            yield hit
+        self.event_spool.flush(action_type, day_key)
+
+    def _load_incremental_state(self):
+        """Load the persisted extraction watermarks and previously materialized sessions"""
+        self.watermarks = {}
+        self._pending_watermarks = {}
+        self._failed_extractions = set()
+        self.materialized = {'results_lookup': {}, 'query_metadata': {}, 'interactions': []}
+        self._new_interactions = []
+        if not self.incremental:
+            return
+        try:
+            if os.path.exists(self.watermark_path):
+                with open(self.watermark_path, 'r') as f:
+                    self.watermarks = json.load(f).get('actions', {})
+            if os.path.exists(self.materialized_path):
+                with open(self.materialized_path, 'rb') as f:
+                    self.materialized = pickle.load(f)
+            for action_type, watermark in self.watermarks.items():
+                print(f"📍 Watermark for {action_type}: {watermark['timestamp']}")
+        except Exception as e:
+            print(f"⚠️  Failed to load incremental state, falling back to a full extraction: {e}")
+            self.watermarks = {}
+            self.materialized = {'results_lookup': {}, 'query_metadata': {}, 'interactions': []}
+
+    def _start_pending_watermark(self, action_type):
+        """A candidate watermark for one extraction stream, starting from the persisted one"""
+        previous = self.watermarks.get(action_type)
+        if previous:
+            return {'ts': self._parse_timestamp(previous['timestamp']),
+                    'timestamp': previous['timestamp'],
+                    'event_ids': list(previous.get('event_ids', []))}
+        return {'ts': None, 'timestamp': None, 'event_ids': []}
+
+    def _observe_watermark(self, pending, hit):
+        """Track the latest @timestamp (and the event ids sharing it) seen in a stream"""
+        raw_ts = hit['_source'].get('@timestamp')
+        if not raw_ts:
+            return
+        try:
+            ts = self._parse_timestamp(raw_ts)
+        except ValueError:
+            print(f"⚠️  Ignoring unparseable @timestamp {raw_ts!r} on event {hit.get('_id')}")
+            return
+        if pending['ts'] is None or ts > pending['ts']:
+            pending.update(ts=ts, timestamp=raw_ts, event_ids=[hit['_id']])
+        elif ts == pending['ts'] and hit['_id'] not in pending['event_ids']:
+            pending['event_ids'].append(hit['_id'])
+
+    def _discard_pending_watermark(self, action_type):
+        """Keep the persisted watermark for an action type whose extraction failed"""
+        self._failed_extractions.add(action_type)
+        self._pending_watermarks.pop(action_type, None)
+        if self.incremental:
+            print(f"⚠️  Not advancing the {action_type} watermark after the failed extraction")
+
+    def _parse_timestamp(self, raw_ts):
+        """Parse an ECS @timestamp (ISO 8601, possibly with a trailing Z) as an aware UTC datetime"""
+        ts = datetime.fromisoformat(raw_ts.replace('Z', '+00:00'))
+        # Offset-less timestamps are UTC, like Elasticsearch date fields
+        return ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts.astimezone(timezone.utc)
+
+    def _merge_materialized_sessions(self, results_lookup, query_metadata):
+        """Merge freshly extracted sessions into the previously materialized ones"""
+        merged_results = self.materialized['results_lookup']
+        merged_metadata = self.materialized['query_metadata']
+        for session_id, positions in results_lookup.items():
+            merged_results.setdefault(session_id, {}).update(positions)
+        for session_id, metadata in query_metadata.items():
+            merged_metadata.setdefault(session_id, metadata)
+        return merged_results, merged_metadata
+
+    def _stream_incremental_interactions(self):
+        """Yield previously materialized interactions followed by the delta, recording the delta compactly"""
+        yield from self.materialized['interactions']
+        for event in self._stream_event_sources("property_engagement"):
+            custom = event.get('custom', {})
+            compact = {'@timestamp': event.get('@timestamp'), 'custom': {
+                'session': {'id': custom.get('session', {}).get('id')},
+                'result': {
+                    'document_id': custom.get('result', {}).get('document_id'),
+                    'position': custom.get('result', {}).get('position', 0)
+                },
+                'interaction': {'type': custom.get('interaction', {}).get('type', '')}
+            }}
+            self._new_interactions.append(compact)
+            yield compact
+
+    def _prune_materialized(self):
+        """Drop materialized sessions (and their interactions) older than the training window"""
+        cutoff = self._resolve_window_start(self.training_window)
+        kept_metadata = {}
+        for session_id, metadata in self.materialized['query_metadata'].items():
+            try:
+                if self._parse_timestamp(metadata['timestamp']) < cutoff:
+                    continue
+            except (KeyError, TypeError, ValueError):
+                continue
+            search_event = metadata.get('search_event') or {}
+            # Only the query (filters included) of the event is read after extraction
+            metadata['search_event'] = {'@timestamp': search_event.get('@timestamp'),
+                                        'custom': {'query': search_event.get('custom', {}).get('query', {})}}
+            kept_metadata[session_id] = metadata
+        pruned = len(self.materialized['query_metadata']) - len(kept_metadata)
+        self.materialized = {
+            'results_lookup': {session_id: positions
+                               for session_id, positions in self.materialized['results_lookup'].items()
+                               if session_id in kept_metadata},
+            'query_metadata': kept_metadata,
+            'interactions': [event for event in self.materialized['interactions']
+                             if event.get('custom', {}).get('session', {}).get('id') in kept_metadata]
+        }
+        if pruned:
+            print(f"🧹 Pruned {pruned} materialized sessions older than {self.training_window}")
+
+    def save_incremental_state(self):
+        """Persist materialized sessions and advance the extraction watermarks"""
+        if not self.incremental:
+            return
+        try:
+            os.makedirs(self.models_dir, exist_ok=True)
+            if "property_engagement" in self._failed_extractions:
+                # The delta is re-read from the unchanged watermark next run
+                self._new_interactions = []
+            self.materialized['interactions'].extend(self._new_interactions)
+            self._new_interactions = []
+            self._prune_materialized()
+            tmp_path = self.materialized_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(self.materialized, f)
+            os.replace(tmp_path, self.materialized_path)
+
+            for action_type, pending in self._pending_watermarks.items():
+                if pending['timestamp'] and action_type not in self._failed_extractions:
+                    self.watermarks[action_type] = {
+                        'timestamp': pending['timestamp'],
+                        'event_ids': pending['event_ids']
+                    }
+            self._pending_watermarks = {}
+            tmp_path = self.watermark_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'updated_at': datetime.now().isoformat(), 'actions': self.watermarks}, f, indent=2)
+            os.replace(tmp_path, self.watermark_path)
+            print(f"✅ Saved extraction watermark to {self.watermark_path} "
+                  f"({len(self.materialized['query_metadata'])} materialized sessions)")
+        except Exception as e:
+            print(f"⚠️  Failed to save incremental state: {e}")
+
     def prepare_training_features(self, interaction_events, results_lookup, query_metadata):
         """Convert raw ECS events to LTR training features with property enrichment"""
         print("🔧 Preparing ENHANCED training features from ECS events...")
@@ -720,6 +3214,19 @@ class UnifiedDataStreamLTRTrainer:
         
         # Create interaction lookup
         interaction_lookup = self._build_interaction_lookup(interaction_events)
+
+        # Load every candidate property up front instead of one get per position
+        self.prefetch_properties(results_lookup)
+
+        # Enrich each unique (query, document) pair once across all sessions
+        if self.enrich_property_features:
+            try:
+                self.plan_property_enrichment(results_lookup, query_metadata)
+            except ValueError as e:
+                # Local feature engines that cannot serve these documents (unbuildable or mis-keyed corpus)
+                print(f"❌ Property enrichment failed: {e}")
+                return None
+            self.plan_geo_features(results_lookup, query_metadata)
         
         # Process search results to create training examples
         training_examples = self._process_search_results_for_training(results_lookup, query_metadata, interaction_lookup)
@@ -727,6 +3234,359 @@ class UnifiedDataStreamLTRTrainer:
         print(f"✅ Created {len(training_examples)} training examples")
         return training_examples
         
+    def normalize_query(self, query: str) -> str:
+        """Normalized query text used to dedupe enrichment work (case and whitespace insensitive)"""
+        return ' '.join((query or '').lower().split())
+
+    def plan_property_enrichment(self, results_lookup, query_metadata):
+        """Collect unique (normalized query, document) pairs across sessions and enrich each exactly once"""
+        pairs_by_query = {}
+        raw_queries = {}  # normalized query -> Counter of the raw spellings seen
+        total_rows = 0
+        for session_id, metadata in query_metadata.items():
+            results_count = metadata.get('results_count', 0)
+            session_results = results_lookup.get(session_id, {})
+            if not session_id or results_count == 0 or not session_results:
+                continue
+            normalized = self.normalize_query(metadata.get('query', ''))
+            raw_queries.setdefault(normalized, Counter())[metadata.get('query') or ''] += 1
+            doc_ids = pairs_by_query.setdefault(normalized, {})
+            for position in range(1, min(11, results_count + 1)):
+                doc_id = session_results.get(position)
+                if doc_id and self._is_known_property(doc_id):
+                    doc_ids[doc_id] = None  # insertion-ordered set
+                    total_rows += 1
+
+        unique_pairs = sum(len(doc_ids) for doc_ids in pairs_by_query.values())
+        # Title hits from an earlier plan do not cover this plan's (query, document) pairs
+        self.title_matches = {}
+        self.title_match_patterns = set()
+        # Featurizers see the most common raw spelling (cased models and the cluster score raw text)
+        representative = {normalized: spellings.most_common(1)[0][0] for normalized, spellings in raw_queries.items()}
+        start = time.perf_counter()
+
+        result_ids = {doc_id for doc_ids in pairs_by_query.values() for doc_id in doc_ids}
+        if self._ensure_local_bm25() is not None:
+            self._check_local_coverage(
+                'BM25 corpus', self.local_bm25.doc_index, result_ids, 'bm25',
+                'set LTR_OFFLINE_PROPERTIES_ID_FIELD, or unset LTR_BM25_CORPUS to index the properties index'
+            )
+        if self.local_semantic is not None:
+            self._check_local_coverage(
+                'embedding matrix', self.local_semantic.doc_index, result_ids, 'semantic',
+                'rebuild it with build-embeddings, which reads the properties index unless --offline'
+            )
+
+        if self.local_bm25 is not None and self.bm25_seed_termvectors and self.es_client is not None:
+            candidates = {doc_id for doc_ids in pairs_by_query.values() for doc_id in doc_ids}
+            try:
+                seeded = self.local_bm25.seed_from_termvectors(self.es_client, sorted(candidates))
+                print(f"📚 Seeded local BM25 index from mtermvectors for {seeded} documents")
+            except Exception as e:
+                print(f"⚠️  mtermvectors seeding failed, keeping local statistics: {e}")
+
+        # Read through the feature store: only families missing at their current version are computed
+        all_families = list(FEATURE_FAMILY_VERSIONS)
+        stored = {}
+        store_hits = 0
+        content_hashes = {}
+        for query, doc_ids in pairs_by_query.items():
+            if self.feature_store is not None:
+                for doc_id in doc_ids:
+                    if doc_id not in content_hashes:
+                        property_data = self._get_property_data(doc_id)
+                        content_hashes[doc_id] = (FeatureStore.content_hash(property_data)
+                                                  if property_data is not None else None)
+                stored[query] = self.feature_store.get_many(query, {doc_id: content_hashes[doc_id] for doc_id in doc_ids})
+                store_hits += sum(len(families) for families in stored[query].values())
+
+        batches = []  # (query, doc_ids, families) groups with the same missing families
+        for query, doc_ids in pairs_by_query.items():
+            by_missing = {}
+            for doc_id in doc_ids:
+                cached = stored.get(query, {}).get(doc_id, {})
+                missing = tuple(f for f in all_families if f not in cached)
+                if missing:
+                    by_missing.setdefault(missing, []).append(doc_id)
+            for missing, missing_doc_ids in by_missing.items():
+                for i in range(0, len(missing_doc_ids), self.enrich_batch_size):
+                    batches.append((query, missing_doc_ids[i:i + self.enrich_batch_size], missing))
+
+        if self.use_token_index:
+            # Index every document that still needs matching features once, before the per-batch products
+            self.token_rows([doc_id for _, batch, missing in batches if 'matching' in missing for doc_id in batch])
+            matching_batches = [(representative[query], batch) for query, batch, missing in batches
+                                if 'matching' in missing]
+            if matching_batches:
+                self.match_titles({query for query, _ in matching_batches},
+                                  [doc_id for _, batch in matching_batches for doc_id in batch])
+
+        # BM25 and both semantic fields for every batch travel together in msearch bundles
+        cluster_batches = [
+            (representative[query], batch if any(f in self._cluster_families() for f in missing) else [])
+            for query, batch, missing in batches
+        ]
+        batch_scores = self._msearch_cluster_scores(cluster_batches) if self.es_client is not None else {}
+        computed = {}
+        for index, (query, batch, missing) in enumerate(batches):
+            families_by_doc = self.compute_feature_families(representative[query], batch, list(missing),
+                                                            batch_scores.get(index, {}))
+            for doc_id, families in families_by_doc.items():
+                computed[(query, doc_id)] = families
+                if self.feature_store is not None:
+                    for family, family_features in families.items():
+                        self.feature_store.put(query, doc_id, family, family_features, content_hashes[doc_id])
+        if self.feature_store is not None:
+            self.feature_store.flush()
+
+        for query, doc_ids in pairs_by_query.items():
+            for doc_id in doc_ids:
+                features = self.get_default_property_features()
+                families = dict(stored.get(query, {}).get(doc_id, {}), **computed.get((query, doc_id), {}))
+                for family in all_families:
+                    features.update(families.get(family, {}))
+                self.planned_property_features[(query, doc_id)] = features
+
+        dedup_ratio = total_rows / unique_pairs if unique_pairs else 1.0
+        print(f"🧮 Enrichment plan: {total_rows} rows -> {unique_pairs} unique (query, document) pairs "
+              f"across {len(pairs_by_query)} queries (dedup ratio {dedup_ratio:.1f}x) "
+              f"in {time.perf_counter() - start:.2f}s")
+        if self.feature_store is not None:
+            lookups = unique_pairs * len(all_families)
+            print(f"🗄️  Feature store: {store_hits}/{lookups} feature families reused, "
+                  f"{sum(len(f) for f in computed.values())} computed")
+
+    def _ensure_geo_index(self) -> PropertyGeoIndex:
+        """Build the geo index once from the properties file (offline) or an index scan"""
+        if self.geo_index is None:
+            start = time.perf_counter()
+            from_index = self.data_source is None
+            try:
+                documents = self._load_property_documents(from_index, fields=['geo_point'])
+            except Exception as e:
+                print(f"⚠️  Could not load property coordinates up front: {e}")
+                documents = []
+            self.geo_index = PropertyGeoIndex.from_documents(documents, precision=self.geohash_precision)
+            source = 'properties index' if from_index else self.properties_file
+            print(f"🌍 Geo index: {self.geo_index.size} properties from {source}, "
+                  f"geohash precision {self.geohash_precision} in {time.perf_counter() - start:.2f}s")
+        return self.geo_index
+
+    def geo_rows(self, doc_ids: List[str]) -> np.ndarray:
+        """Geo index rows for doc_ids, adding documents the index has not seen yet (-1 if unavailable)"""
+        index = self._ensure_geo_index()
+        rows = index.rows(doc_ids)
+        for i in np.flatnonzero(rows < 0):
+            property_data = self._get_property_data(doc_ids[i])
+            if property_data is not None:
+                rows[i] = index.add(doc_ids[i], property_data)
+        return rows
+
+    def session_geo_origin(self, metadata: dict) -> Optional[Tuple[float, float, float]]:
+        """(lat, lon, radius km) of the session's query.filters.geo, None without a usable geo filter"""
+        search_event = metadata.get('search_event') or {}
+        query = search_event.get('custom', {}).get('query', {})
+        geo = (query.get('filters') or {}).get('geo')
+        if not isinstance(geo, dict):
+            return None
+        try:
+            lat = float(geo.get('latitude', geo.get('lat')))
+            lon = float(geo.get('longitude', geo.get('lon')))
+        except (TypeError, ValueError):
+            return None
+        return lat, lon, PropertyGeoIndex.parse_distance_km(geo.get('distance'))
+
+    def plan_geo_features(self, results_lookup, query_metadata):
+        """Distance features for every result of every geo-filtered session in one vectorized pass
+
+        Sessions without a geo filter keep the query-level geo family.
+        """
+        start = time.perf_counter()
+        session_ids, doc_ids, origins = [], [], []
+        for session_id, metadata in query_metadata.items():
+            origin = self.session_geo_origin(metadata)
+            if origin is None:
+                continue
+            session_results = results_lookup.get(session_id, {})
+            for position in range(1, min(11, metadata.get('results_count', 0) + 1)):
+                doc_id = session_results.get(position)
+                if doc_id and self._is_known_property(doc_id):
+                    session_ids.append(session_id)
+                    doc_ids.append(doc_id)
+                    origins.append(origin)
+        if not doc_ids:
+            return
+
+        index = self._ensure_geo_index()
+        rows = self.geo_rows(doc_ids)
+        origins = np.array(origins, dtype=np.float64)
+        # Documents without coordinates keep the query-level geo family
+        located = np.flatnonzero((rows >= 0) & ~np.isnan(index.lat[np.maximum(rows, 0)]))
+        lat, lon, radius = origins[located, 0], origins[located, 1], origins[located, 2]
+        distance = index.distance_km(lat, lon, rows[located])
+        relevance = np.exp(-distance / radius)
+        same_cell = index.same_cell(lat, lon, rows[located])
+        for i, row in enumerate(located.tolist()):
+            self.planned_geo_features[(session_ids[row], doc_ids[row])] = {
+                'geo_distance_km': float(distance[i]),
+                'geo_relevance_score': float(relevance[i]),
+                'same_neighborhood': 1.0 if same_cell[i] else 0.0
+            }
+        print(f"🌍 Geo features: {len(located)}/{len(doc_ids)} geo-filtered rows across "
+              f"{len(set(session_ids))} sessions in {time.perf_counter() - start:.2f}s")
+
+    def _check_local_coverage(self, name, doc_index, doc_ids, family, remedy):
+        """Fail when no result document is in a local feature index (ids keyed differently from the events)"""
+        if not doc_ids:
+            return
+        covered = sum(1 for doc_id in doc_ids if doc_id in doc_index)
+        if covered == 0:
+            raise ValueError(
+                f"None of the {len(doc_ids)} result documents is in the local {name}; its ids do not match "
+                f"the event document ids ({remedy})"
+            )
+        if covered < len(doc_ids):
+            print(f"⚠️  Local {name} covers {covered}/{len(doc_ids)} result documents; "
+                  f"the rest keep default {family} features")
+
+    def _cluster_families(self) -> Tuple[str, ...]:
+        """Feature families that still need Elasticsearch searches"""
+        local = {'bm25': self.local_bm25 is not None, 'semantic': self.local_semantic is not None}
+        return tuple(f for f in CLUSTER_FEATURE_FAMILIES if not local[f])
+
+    def _msearch_cluster_scores(self, batches) -> Dict[int, Dict[str, Dict[str, Dict[str, float]]]]:
+        """BM25 + semantic scores for (query, doc_ids) batches, bundled into msearch calls and demultiplexed per batch
+
+        Returns batch index -> doc_id -> family -> features; a family whose sub-search failed is left out.
+        """
+        sub_searches = []  # (batch index, semantic field or None for BM25, body)
+        for index, (query, doc_ids) in enumerate(batches):
+            if not query or not doc_ids:
+                continue
+            if 'bm25' in self._cluster_families():
+                sub_searches.append((index, None, self._bm25_batch_body(query, doc_ids)))
+            if 'semantic' in self._cluster_families():
+                for field in SEMANTIC_FIELDS:
+                    sub_searches.append((index, field, self._semantic_batch_body(field, query, doc_ids)))
+
+        hits_by_search = {}
+        bundle, bundle_bytes, msearch_calls = [], 0, 0
+        for position, (_, _, body) in enumerate(sub_searches):
+            body_bytes = len(json.dumps(body)) + 4  # header "{}" plus two newlines
+            if bundle and bundle_bytes + body_bytes > self.msearch_max_bytes:
+                hits_by_search.update(self._run_msearch(bundle, sub_searches))
+                msearch_calls += 1
+                bundle, bundle_bytes = [], 0
+            bundle.append(position)
+            bundle_bytes += body_bytes
+        if bundle:
+            hits_by_search.update(self._run_msearch(bundle, sub_searches))
+            msearch_calls += 1
+
+        field_scores = {}
+        bm25_hits = {}
+        failed = set()  # (batch index, family)
+        for position, (index, field, _) in enumerate(sub_searches):
+            if position not in hits_by_search:
+                failed.add((index, 'bm25' if field is None else 'semantic'))
+                continue
+            hits = hits_by_search[position]
+            if field is None:
+                bm25_hits[index] = hits
+            else:
+                field_scores.setdefault(index, {})[field] = {hit['_id']: hit['_score'] for hit in hits}
+
+        batch_scores = {}
+        for index, (_, doc_ids) in enumerate(batches):
+            if not doc_ids:
+                continue
+            bm25_scores = self._parse_bm25_hits(doc_ids, bm25_hits.get(index, []))
+            semantic_scores = self._combine_semantic_scores(doc_ids, field_scores.get(index, {}))
+            batch_scores[index] = {doc_id: {} for doc_id in doc_ids}
+            for doc_id in doc_ids:
+                if (index, 'bm25') not in failed and 'bm25' in self._cluster_families():
+                    batch_scores[index][doc_id]['bm25'] = bm25_scores[doc_id]
+                if (index, 'semantic') not in failed and 'semantic' in self._cluster_families():
+                    batch_scores[index][doc_id]['semantic'] = semantic_scores[doc_id]
+        if sub_searches:
+            print(f"📦 Bundled {len(sub_searches)} enrichment searches into {msearch_calls} msearch calls")
+        return batch_scores
+
+    def _run_msearch(self, positions, sub_searches) -> Dict[int, list]:
+        searches = []
+        for position in positions:
+            searches.extend([{}, sub_searches[position][2]])
+        try:
+            response = self.es_client.msearch(
+                index='properties',
+                searches=searches,
+                include_named_queries_score=True,
+                filter_path=MSEARCH_SCORES_FILTER_PATH
+            )
+            self._record_payload('properties.msearch', response)
+        except Exception as e:
+            print(f"⚠️  msearch of {len(positions)} enrichment searches failed: {e}")
+            return {}
+        hits_by_search = {}
+        for position, item in zip(positions, response.get('responses', [])):
+            if 'error' in item:
+                print(f"⚠️  Enrichment sub-search failed: {item['error'].get('reason', item['error'])}")
+                continue
+            hits_by_search[position] = item.get('hits', {}).get('hits', [])
+        return hits_by_search
+
+    def _candidate_document_ids(self, results_lookup):
+        """Distinct document ids at the positions used for training (top 10)"""
+        doc_ids = set()
+        for session_results in results_lookup.values():
+            for position, doc_id in session_results.items():
+                if doc_id and position <= 10:
+                    doc_ids.add(doc_id)
+        return doc_ids
+
+    def prefetch_properties(self, results_lookup):
+        """Bulk-load all candidate properties into the property cache with concurrent batched mget calls"""
+        doc_ids = [doc_id for doc_id in self._candidate_document_ids(results_lookup) if doc_id not in self.property_cache]
+        if not doc_ids:
+            return
+        start = time.perf_counter()
+        if self.data_source:
+            for doc_id in doc_ids:
+                property_data = self.data_source.get_property(doc_id)
+                if property_data is not None:
+                    self.property_cache[doc_id] = property_data
+            print(f"✅ Prefetched {len(doc_ids)} properties from {self.data_source.name} data source")
+            return
+
+        batches = [doc_ids[i:i + self.mget_batch_size] for i in range(0, len(doc_ids), self.mget_batch_size)]
+        found = 0
+        with ThreadPoolExecutor(max_workers=self.mget_concurrency, thread_name_prefix='ltr-mget') as executor:
+            for docs in executor.map(self._mget_properties, batches):
+                for doc in docs:
+                    self.resolved_property_ids.add(doc['_id'])
+                    if doc.get('found'):
+                        self.property_cache[doc['_id']] = doc.get('_source', {})
+                        self.existing_property_ids.add(doc['_id'])
+                        found += 1
+        elapsed = time.perf_counter() - start
+        print(f"✅ Prefetched {found}/{len(doc_ids)} properties in {len(batches)} mget batches "
+              f"({self.mget_concurrency} concurrent) in {elapsed:.2f}s")
+
+    def _mget_properties(self, doc_ids):
+        """Fetch one batch of property documents, returning an empty list if the batch fails"""
+        try:
+            response = self.es_client.mget(
+                index='properties',
+                ids=doc_ids,
+                source_includes=PROPERTY_SOURCE_FIELDS,
+                filter_path='docs._id,docs.found,docs._source'
+            )
+            self._record_payload('properties.mget', response)
+            return response.get('docs', [])
+        except Exception as e:
+            print(f"⚠️  mget prefetch failed for a batch of {len(doc_ids)} properties: {e}")
+            return []
+
     def _build_interaction_lookup(self, interaction_events):
         """Create lookup structure for interaction events by session_id and document_id (aligned with new schema)"""
         interaction_lookup = {}
@@ -783,6 +3643,10 @@ class UnifiedDataStreamLTRTrainer:
     def _process_search_positions(self, session_id, query, results_count, search_time, template_id,
                                 session_results, interaction_lookup, training_examples, search_event, metadata=None):
         """Process each position in search results to create training examples"""
+        normalized_query = self.normalize_query(query)
+        # Query/template features are the same for every position of the session
+        session_features = self._session_query_features(query, template_id)
+
         # Generate features for each position (up to top 10)
         for position in range(1, min(11, results_count + 1)):
             # Use actual document ID from search results
@@ -796,10 +3660,14 @@ class UnifiedDataStreamLTRTrainer:
                 continue
             
             # Extract base features with metadata
-            features = self._extract_base_features(position, search_time, template_id, query, search_event, metadata)
+            features = self._extract_base_features(position, search_time, template_id, query, search_event, metadata,
+                                                   session_features)
             
             # Enrich with property data
             features = self._enrich_features_with_property_data(features, doc_id, query)
+            # Fan out the planned (query, document) enrichment to this row
+            features.update(self.planned_property_features.get((normalized_query, doc_id), {}))
+            features.update(self.planned_geo_features.get((session_id, doc_id), {}))
             
             # Calculate relevance
             key = f"{session_id}_{doc_id}"
@@ -817,7 +3685,7 @@ class UnifiedDataStreamLTRTrainer:
     def _verify_document_exists(self, doc_id):
         """Verify document exists in properties index"""
         try:
-            exists = self.es_client.exists(index='properties', id=doc_id)
+            exists = self._is_known_property(doc_id)
             if not exists:
                 print(f"⚠️  Skipping document ID {doc_id} as it doesn't exist in properties index")
                 return False
@@ -826,8 +3694,21 @@ class UnifiedDataStreamLTRTrainer:
             print(f"⚠️  Error checking document existence for {doc_id}: {e}")
             return False
     
-    def _extract_base_features(self, position, search_time, template_id, query, search_event, metadata=None):
+    def _session_query_features(self, query, template_id):
+        """Base features that depend only on the query text and template"""
+        analysis = self.query_analyzer.analyze(query)
+        return {
+            'template_complexity': 0.8 if 'rrf' in template_id else 0.6 if 'linear-v2' in template_id else 0.4,
+            'query_length': len(query),
+            'query_word_count': analysis.word_count,
+            'query_complexity_score': analysis.complexity_score
+        }
+
+    def _extract_base_features(self, position, search_time, template_id, query, search_event, metadata=None,
+                               session_features=None):
         """Extract base features for a search result position"""
+        if session_features is None:
+            session_features = self._session_query_features(query, template_id)
         # Use metadata for filter information if provided
         has_geo_filter = 0.0
         has_price_filter = 0.0
@@ -852,10 +3733,10 @@ class UnifiedDataStreamLTRTrainer:
             'position_engagement_signal': 0.0,  # Default value, will be updated with interactions
             'elasticsearch_score': max(0, 10 - position + np.random.normal(0, 0.5)),
             'search_time_ms': search_time,
-            'template_complexity': 0.8 if 'rrf' in template_id else 0.6 if 'linear-v2' in template_id else 0.4,
-            'query_length': len(query),
-            'query_word_count': len(query.split()),
-            'query_complexity_score': 0.8 if len(query.split()) > 3 else 0.5,
+            'template_complexity': session_features['template_complexity'],
+            'query_length': session_features['query_length'],
+            'query_word_count': session_features['query_word_count'],
+            'query_complexity_score': session_features['query_complexity_score'],
             'has_geo_filter': has_geo_filter,
             'has_price_filter': has_price_filter,
             'has_bedroom_filter': has_bedroom_filter,
@@ -872,15 +3753,36 @@ class UnifiedDataStreamLTRTrainer:
             'exact_match_score': max(0, 1 - (position - 1) * 0.15 + np.random.normal(0, 0.1))
         }
     
+    def _get_property_data(self, doc_id):
+        """Property _source from the cache, the data source or the properties index (None if missing)"""
+        # Use cache to avoid repeated ES calls for the same property
+        property_data = self.property_cache.get(doc_id)
+        if property_data is not None:
+            return property_data
+        if self.data_source:
+            property_data = self.data_source.get_property(doc_id)
+        else:
+            try:
+                doc_response = self.es_client.get(
+                    index='properties',
+                    id=doc_id,
+                    source_includes=PROPERTY_SOURCE_FIELDS,
+                    filter_path=PROPERTY_GET_FILTER_PATH
+                )
+            except Exception as e:
+                print(f"⚠️  Failed to fetch property {doc_id}: {e}")
+                return None
+            self._record_payload('properties.get', doc_response)
+            property_data = doc_response.get('_source')
+        if property_data is not None:
+            self.property_cache[doc_id] = property_data
+        return property_data
+
     def _enrich_features_with_property_data(self, features, doc_id, query):
         try:
-            # Use cache to avoid repeated ES calls for the same property
-            if doc_id in self.property_cache:
-                property_data = self.property_cache[doc_id]
-            else:
-                doc_response = self.es_client.get(index='properties', id=doc_id)
-                property_data = doc_response['_source']
-                self.property_cache[doc_id] = property_data
+            property_data = self._get_property_data(doc_id)
+            if property_data is None:
+                raise ValueError(f"Document ID {doc_id} could not be loaded")
             # Remove all custom property profile scoring (no low_mode_match_score, high_mode_match_score, etc.)
             # Only enrich with property features as extracted
             for key, value in property_data.items():
@@ -1783,6 +4685,12 @@ class UnifiedDataStreamLTRTrainer:
         training_examples = self.prepare_training_features(
             interaction_events, results_lookup, query_metadata
         )
+        if training_examples is None:
+            return False
+        self.save_incremental_state()
+        self.report_payload_stats()
+        self.report_property_cache_stats()
+        self.report_query_cache_stats()
         if len(training_examples) < 50:
             print(f"❌ Insufficient training examples: {len(training_examples)}")
             return False
@@ -1836,14 +4744,15 @@ class UnifiedDataStreamLTRTrainer:
             print("❌ No search results found")
             return None, None, None
             
-        # Extract interaction events
+        # Extract interaction events (streamed; peek the first one to detect an empty stream)
         interaction_events = self.extract_interaction_events()
-        if not interaction_events:
+        first_event = next(interaction_events, None)
+        if first_event is None:
             print("❌ No interaction events found")
             return query_metadata, results_lookup, None
-            
-        print(f"✅ Extracted metadata for {len(query_metadata)} search queries, {len(results_lookup)} result sets, " 
-              f"and {len(interaction_events)} interaction events")
+        interaction_events = itertools.chain([first_event], interaction_events)
+
+        print(f"✅ Extracted metadata for {len(query_metadata)} search queries and {len(results_lookup)} result sets")
               
         return query_metadata, results_lookup, interaction_events
         print("\n💡 Next steps:")
@@ -1871,6 +4780,12 @@ class UnifiedDataStreamLTRTrainer:
             
             # Prepare training data
             self.training_examples = self.prepare_training_features(interaction_events, results_lookup, query_metadata)
+            if self.training_examples is None:
+                return False
+            self.save_incremental_state()
+            self.report_payload_stats()
+            self.report_property_cache_stats()
+            self.report_query_cache_stats()
             
             # Train model
             model_trained = self.train_xgboost_model(self.training_examples)
@@ -1933,11 +4848,21 @@ class UnifiedDataStreamLTRTrainer:
 app = typer.Typer(help="XGBoost Learn to Rank Model Trainer and Deployer for Elasticsearch")
 
 @app.command()
-def train_model():
+def train_model(
+    slices: int = typer.Option(None, "--slices", help="Number of PIT slices to export events with concurrently (default: LTR_EXTRACT_SLICES or 1)"),
+    full_refresh: bool = typer.Option(False, "--full-refresh", help="Discard the persisted extraction watermark and materialized sessions"),
+    extraction_mode: str = typer.Option(None, "--extraction-mode", help="'stream' (raw hits) or 'composite' (server-side session aggregation); default: LTR_EXTRACTION_MODE or stream"),
+    offline: bool = typer.Option(False, "--offline", help="Train from event/property files (LTR_OFFLINE_EVENTS, LTR_OFFLINE_PROPERTIES) without an Elasticsearch connection"),
+    properties_id_field: str = typer.Option(None, "--properties-id-field", help="Properties file field holding the document id events refer to (default: LTR_OFFLINE_PROPERTIES_ID_FIELD, else _id/id, else line number)")
+):
     """Train the XGBoost LTR model without deployment"""
     print("🏋️ Starting model training process...")
-    trainer = UnifiedDataStreamLTRTrainer()
-    success = trainer.train_model()
+    trainer = UnifiedDataStreamLTRTrainer(slices=slices, full_refresh=full_refresh, extraction_mode=extraction_mode,
+                                          offline=offline, properties_id_field=properties_id_field)
+    try:
+        success = trainer.train_model()
+    finally:
+        trainer.close()
     if success:
         print("✅ Model training completed successfully!")
     else:
@@ -1957,12 +4882,41 @@ def deploy_model():
         raise typer.Exit(code=1)
 
 @app.command()
-def train_and_deploy_model():
+def build_embeddings(
+    offline: bool = typer.Option(False, "--offline", help="Read properties from LTR_OFFLINE_PROPERTIES instead of scanning the Elasticsearch index"),
+    properties_id_field: str = typer.Option(None, "--properties-id-field", help="Properties file field holding the document id events refer to (default: LTR_OFFLINE_PROPERTIES_ID_FIELD, else _id/id, else line number)"),
+    chunk_size: int = typer.Option(1024, "--chunk-size", help="Properties encoded per chunk written to the matrix")
+):
+    """Precompute property embeddings for local semantic features (LTR_SEMANTIC_ENGINE=local)"""
+    print("🧭 Building property embedding matrix...")
+    trainer = UnifiedDataStreamLTRTrainer(offline=offline, properties_id_field=properties_id_field)
+    if not trainer.build_property_embeddings(chunk_size=chunk_size):
+        raise typer.Exit(code=1)
+
+@app.command()
+def benchmark_embeddings(
+    limit: int = typer.Option(2000, "--limit", help="Number of property texts to encode with each encoder"),
+    field: str = typer.Option("property-description", "--field", help="Property text field to encode")
+):
+    """Compare fp32 and int8-quantized embedding encoders on LTR_OFFLINE_PROPERTIES"""
+    trainer = UnifiedDataStreamLTRTrainer(offline=True)
+    if not trainer.benchmark_embedding_encoders(limit=limit, field=field):
+        raise typer.Exit(code=1)
+
+@app.command()
+def train_and_deploy_model(
+    slices: int = typer.Option(None, "--slices", help="Number of PIT slices to export events with concurrently (default: LTR_EXTRACT_SLICES or 1)"),
+    full_refresh: bool = typer.Option(False, "--full-refresh", help="Discard the persisted extraction watermark and materialized sessions"),
+    extraction_mode: str = typer.Option(None, "--extraction-mode", help="'stream' (raw hits) or 'composite' (server-side session aggregation); default: LTR_EXTRACTION_MODE or stream")
+):
     """Train and deploy the XGBoost LTR model"""
     print("🔄 Starting full training and deployment pipeline...")
-    trainer = UnifiedDataStreamLTRTrainer()
+    trainer = UnifiedDataStreamLTRTrainer(slices=slices, full_refresh=full_refresh, extraction_mode=extraction_mode)
     print("🏋️ Step 1: Training model...")
-    training_success = trainer.train_model()
+    try:
+        training_success = trainer.train_model()
+    finally:
+        trainer.close()
     if not training_success:
         print("❌ Training step failed, stopping pipeline")
         raise typer.Exit(code=1)